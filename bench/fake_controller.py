@@ -0,0 +1,159 @@
+#!/opt/bin/python3
+# -*- coding: utf-8 -*-
+"""Заглушка external-controller mihomo для локальных замеров без роутера.
+
+Запуск:  python3 fake_controller.py [--port 9090] [--proxies 300] [--secret S]
+                                    [--delay-ms 20,300] [--dead 0.1] [--interval 1]
+
+Отдаёт /version, /proxies, /proxies/<name>, /proxies/<name>/delay,
+/group/<name>/delay, /configs (GET/PUT/PATCH), /connections и бесконечные
+потоки /traffic и /logs (chunked, строка JSON раз в --interval секунд).
+Слушает только 127.0.0.1.
+"""
+import argparse
+import http.server
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+ARGS = None
+PROXIES = {}
+
+
+def build_proxies(n):
+    out = {}
+    for i in range(n):
+        name = f"node-{i:05d}"
+        out[name] = {'name': name, 'type': 'Vless' if i % 5 else 'Shadowsocks', 'udp': True, 'alive': True,
+                     'history': [{'time': '2025-01-01T00:00:00Z', 'delay': 100 + i % 200}]}
+    members = list(out)
+    for g, kind in (('PROXY', 'Selector'), ('AUTO', 'URLTest'), ('GLOBAL', 'Selector')):
+        out[g] = {'name': g, 'type': kind, 'now': members[0] if members else 'DIRECT', 'all': members, 'history': []}
+    out['DIRECT'] = {'name': 'DIRECT', 'type': 'Direct', 'history': []}
+    return out
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # заголовки и тело уходят разными send()
+
+    def log_message(self, *a):
+        pass
+
+    def send_json(self, obj, code=200):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        if not ARGS.secret or self.headers.get('Authorization') == 'Bearer ' + ARGS.secret: return True
+        self.send_json({'message': 'Unauthorized'}, 401)
+        return False
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def delay(self, name):
+        """Имитирует замер: задержка в диапазоне --delay-ms, доля --dead отвечает таймаутом."""
+        lo, hi = ARGS.delay_ms
+        d = random.randint(lo, hi)
+        time.sleep(d / 1000)
+        if random.random() < ARGS.dead: return None
+        return d
+
+    def stream(self, make_line):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        i = 0
+        try:
+            while True:
+                b = (json.dumps(make_line(i)) + "\n").encode('utf-8')
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(b), b))
+                self.wfile.flush()
+                i += 1
+                time.sleep(ARGS.interval)
+        except OSError:
+            self.close_connection = True  # клиент ушёл
+
+    def do_GET(self):
+        if not self.authorized(): return
+        u = urllib.parse.urlsplit(self.path)
+        parts = [urllib.parse.unquote(x) for x in u.path.strip('/').split('/')]
+        if u.path == '/version':
+            return self.send_json({'meta': True, 'version': 'fake'})
+        if u.path == '/proxies':
+            return self.send_json({'proxies': PROXIES})
+        if parts[0] == 'proxies' and len(parts) >= 2:
+            p = PROXIES.get(parts[1])
+            if p is None: return self.send_json({'message': 'resource not found'}, 404)
+            if len(parts) == 3 and parts[2] == 'delay':
+                d = self.delay(p['name'])
+                if d is None: return self.send_json({'message': 'Timeout'}, 408)
+                return self.send_json({'delay': d})
+            return self.send_json(p)
+        if parts[0] == 'group' and len(parts) == 3 and parts[2] == 'delay':
+            g = PROXIES.get(parts[1])
+            if g is None or 'all' not in g: return self.send_json({'message': 'resource not found'}, 404)
+            return self.send_json({m: random.randint(*ARGS.delay_ms) for m in g['all']})
+        if u.path == '/configs':
+            return self.send_json({'port': 0, 'mixed-port': 7890, 'mode': 'rule', 'log-level': 'info', 'allow-lan': True})
+        if u.path == '/connections':
+            return self.send_json({'downloadTotal': 0, 'uploadTotal': 0, 'connections': []})
+        if u.path == '/traffic':
+            return self.stream(lambda i: {'up': random.randint(0, 1 << 20), 'down': random.randint(0, 1 << 22)})
+        if u.path == '/logs':
+            return self.stream(lambda i: {'type': 'info', 'payload': f"[TCP] 192.168.1.{i % 250}:5{i % 10000:04d} --> "
+                                                                     f"site{i}.example.com:443 match RuleSet(proxy) using PROXY[node-00001]"})
+        self.send_json({'message': 'resource not found'}, 404)
+
+    def do_PUT(self):
+        if not self.authorized(): return
+        body = self.read_body()
+        if urllib.parse.urlsplit(self.path).path != '/configs':
+            return self.send_json({'message': 'resource not found'}, 404)
+        try:
+            json.loads(body or b'{}')
+        except ValueError:
+            return self.send_json({'message': 'Body invalid'}, 400)
+        self.send_response(204)
+        self.end_headers()
+
+    def do_PATCH(self):
+        self.do_PUT()
+
+
+class Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+def main(argv=None):
+    global ARGS, PROXIES
+    ap = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    ap.add_argument('--port', type=int, default=9090)
+    ap.add_argument('--proxies', type=int, default=300, help='число прокси в /proxies')
+    ap.add_argument('--secret', default='')
+    ap.add_argument('--delay-ms', default='20,300', help='диапазон ответа delay, мс')
+    ap.add_argument('--dead', type=float, default=0.1, help='доля замеров с таймаутом')
+    ap.add_argument('--interval', type=float, default=1.0, help='секунд между строками /traffic и /logs')
+    ARGS = ap.parse_args(argv)
+    ARGS.delay_ms = tuple(int(x) for x in ARGS.delay_ms.split(','))
+    PROXIES = build_proxies(ARGS.proxies)
+    srv = Server(('127.0.0.1', ARGS.port), Handler)
+    print(f"fake controller on 127.0.0.1:{ARGS.port}, {ARGS.proxies} proxies", flush=True)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
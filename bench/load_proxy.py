@@ -0,0 +1,168 @@
+#!/opt/bin/python3
+# -*- coding: utf-8 -*-
+"""Нагрузка на /mihomo_panel/ студии: задержки p50/p99, пропускная способность, RSS.
+
+Запуск:  python3 load_proxy.py [--clients 16] [--duration 10] [--streams 4]
+                               [--paths /version,/proxies,/configs] [--proxies 300]
+                               [--studio http://127.0.0.1:8888 --pid PID]
+
+Без --studio скрипт сам поднимает fake_controller.py и студию на свободных
+портах 127.0.0.1 с временным каталогом конфигов, а в конце их останавливает.
+Каждый клиент - поток с одним keep-alive соединением, запросы идут по кругу
+по --paths. --streams держат открытыми бесконечные /traffic, как вкладки
+дашборда. Клиент тоже на Python, поэтому при большом --clients упирается
+в GIL раньше студии - сравнивать имеет смысл прогоны с одинаковыми параметрами.
+"""
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STUDIO = os.path.join(HERE, "..", "mihomo_editor.py")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_port(port, timeout=10):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise SystemExit(f"port {port} did not open")
+
+
+def rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'): return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def spawn(n_proxies):
+    """Заглушка контроллера и студия; возвращает (url, pid студии, процессы)."""
+    c_port, s_port = free_port(), free_port()
+    tmp = tempfile.mkdtemp(prefix="mhstudio_load_")
+    with open(os.path.join(tmp, "config.yaml"), "w") as f:
+        f.write(f"external-controller: 127.0.0.1:{c_port}\nproxies: []\n")
+    quiet = dict(stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    ctrl = subprocess.Popen([sys.executable, os.path.join(HERE, "fake_controller.py"), "--port", str(c_port),
+                             "--proxies", str(n_proxies), "--interval", "0.1"], **quiet)
+    env = dict(os.environ, MHSTUDIO_CONFIG_DIR=tmp, MHSTUDIO_PORT=str(s_port))
+    studio = subprocess.Popen([sys.executable, STUDIO], env=env, **quiet)
+    wait_port(c_port)
+    wait_port(s_port)
+    return f"http://127.0.0.1:{s_port}", studio.pid, [studio, ctrl]
+
+
+def client(host, port, paths, stop, stats):
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    lat, n_bytes, errors, i = [], 0, 0, 0
+    while not stop.is_set():
+        path = paths[i % len(paths)]
+        i += 1
+        t0 = time.perf_counter()
+        try:
+            conn.request('GET', '/mihomo_panel' + path)
+            resp = conn.getresponse()
+            body = resp.read()
+            if resp.status != 200: errors += 1
+            n_bytes += len(body)
+            lat.append(time.perf_counter() - t0)
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+    conn.close()
+    stats.append((lat, n_bytes, errors))
+
+
+def streamer(host, port, stop, stats):
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    lines = 0
+    try:
+        conn.request('GET', '/mihomo_panel/traffic')
+        resp = conn.getresponse()
+        while not stop.is_set():
+            if not resp.readline(): break
+            lines += 1
+    except (OSError, http.client.HTTPException):
+        pass
+    finally:
+        conn.close()
+    stats.append(lines)
+
+
+def pct(sorted_vals, q):
+    if not sorted_vals: return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    ap.add_argument('--clients', type=int, default=16)
+    ap.add_argument('--duration', type=float, default=10)
+    ap.add_argument('--streams', type=int, default=4, help='открытых /traffic на время теста')
+    ap.add_argument('--paths', default='/version,/proxies,/configs')
+    ap.add_argument('--proxies', type=int, default=300, help='размер /proxies у заглушки')
+    ap.add_argument('--studio', help='URL уже запущенной студии (тогда ничего не поднимается)')
+    ap.add_argument('--pid', type=int, help='PID этой студии для замера RSS')
+    args = ap.parse_args()
+
+    procs = []
+    if args.studio:
+        url, pid = args.studio, args.pid
+    else:
+        url, pid, procs = spawn(args.proxies)
+    u = urllib.parse.urlsplit(url)
+    host, port = u.hostname, u.port or 80
+    paths = args.paths.split(',')
+    try:
+        stop, c_stats, s_stats = threading.Event(), [], []
+        threads = [threading.Thread(target=streamer, args=(host, port, stop, s_stats)) for _ in range(args.streams)]
+        threads += [threading.Thread(target=client, args=(host, port, paths, stop, c_stats)) for _ in range(args.clients)]
+        rss0 = rss_kb(pid) if pid else 0
+        rss_peak = rss0
+        t0 = time.monotonic()
+        for t in threads: t.start()
+        while time.monotonic() - t0 < args.duration:
+            time.sleep(0.25)
+            if pid: rss_peak = max(rss_peak, rss_kb(pid))
+        stop.set()
+        for t in threads: t.join()
+        elapsed = time.monotonic() - t0
+    finally:
+        for p in procs:
+            p.terminate()
+            p.wait()
+
+    lat = sorted(x for s in c_stats for x in s[0])
+    n_bytes = sum(s[1] for s in c_stats)
+    errors = sum(s[2] for s in c_stats)
+    print(f"{url}/mihomo_panel  {args.clients} clients, {args.streams} streams, {elapsed:.1f} s, paths {args.paths}")
+    print(f"  requests   {len(lat)} ok, {errors} errors, {len(lat) / elapsed:.0f} req/s, {n_bytes / elapsed / 1048576:.2f} MB/s")
+    print(f"  latency    p50 {pct(lat, 0.5) * 1000:.2f} ms  p90 {pct(lat, 0.9) * 1000:.2f} ms  "
+          f"p99 {pct(lat, 0.99) * 1000:.2f} ms  max {(lat[-1] if lat else 0) * 1000:.2f} ms")
+    if args.streams:
+        print(f"  streams    {sum(s_stats)} lines ({sum(s_stats) / elapsed / max(1, args.streams):.1f}/s per stream)")
+    if pid:
+        print(f"  studio RSS {rss0 / 1024:.1f} MB at start, {rss_peak / 1024:.1f} MB peak")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,10 @@ INIT_DIR="/opt/etc/init.d"
 MIHOMO_ETC_DIR="/opt/etc/mihomo" # Добавлено для совместимости и управления конфигами
 PY_SCRIPT="mihomo_editor.py"
 INIT_SCRIPT="S95mihomo-web"
+ACE_VERSION="1.32.7"
+ACE_CDN="https://cdnjs.cloudflare.com/ajax/libs/ace/${ACE_VERSION}"
+ACE_DIR="/opt/share/mihomo_studio/ace/${ACE_VERSION}"
+ACE_FILES="ace.js mode-yaml.js worker-yaml.js theme-monokai.js theme-chrome.js theme-tomorrow_night_blue.js theme-terminal.js"
 PACKAGES="python3-base python3-light python3-email python3-urllib python3-codecs"
 
 # === ФУНКЦИИ ===
@@ -116,6 +120,23 @@ download_files() {
     if [ $? -ne 0 ]; then echo "ОШИБКА: Не удалось скачать $INIT_SCRIPT."; exit 1; fi
 }
 
+# --- Локальная копия редактора Ace ---
+download_ace() {
+    echo ">>> Скачивание редактора Ace ${ACE_VERSION}..."
+    mkdir -p "$ACE_DIR"
+    for f in $ACE_FILES; do
+        [ -s "$ACE_DIR/$f" ] && continue
+        if wget --no-check-certificate -O "$ACE_DIR/$f" "${ACE_CDN}/${f}" >/dev/null 2>&1; then
+            # Сервис отдаёт готовый .gz, не сжимая файл на лету
+            gzip -9 -c "$ACE_DIR/$f" > "$ACE_DIR/$f.gz"
+        else
+            # Не критично: без локальной копии браузер загрузит Ace с CDN
+            rm -f "$ACE_DIR/$f"
+            echo "ПРЕДУПРЕЖДЕНИЕ: Не удалось скачать $f, будет использован CDN."
+        fi
+    done
+}
+
 # --- Установка прав доступа ---
 set_permissions() {
     echo ">>> Установка прав доступа..."
@@ -145,6 +166,7 @@ install_service() {
     install_dependencies
     create_dirs
     download_files
+    download_ace
     set_permissions
     restart_service
 
@@ -161,6 +183,7 @@ uninstall_service() {
     fi
     rm -f "$INSTALL_DIR/$PY_SCRIPT"
     rm -f "$INIT_DIR/$INIT_SCRIPT"
+    rm -rf "/opt/share/mihomo_studio"
 
     if [ "$mode" = "full" ]; then
         echo "[2/2] Удаление зависимостей..."
@@ -5,23 +5,71 @@ import socketserver
 import os
 import subprocess
 import urllib.parse
-import urllib.request
-import urllib.error
+import http.client
 import re
 import time
 import shutil
 import glob
+import tarfile
+import tempfile
+import zipfile
 import json
+import base64
+import binascii
+import gzip
+import zlib
+import hashlib
+import difflib
+import signal
+import socket
+import select
+import bisect
+import cProfile
+import threading
 from datetime import datetime
 
 # --- НАСТРОЙКИ ---
-PORT = 8888
-CONFIG_DIR = "/opt/etc/mihomo"
+PORT = int(os.environ.get("MHSTUDIO_PORT", 8888))
+CONFIG_DIR = os.environ.get("MHSTUDIO_CONFIG_DIR", "/opt/etc/mihomo")
 CONFIG_PATH = os.path.join(CONFIG_DIR, "config.yaml")
 PROFILES_DIR = os.path.join(CONFIG_DIR, "profiles")
 BACKUP_DIR = os.path.join(CONFIG_DIR, "backup")
+# Каждая N-я версия профиля хранится целиком, остальные - разницей к следующей
+BACKUP_KEYFRAME = 10
 LOG_FILE = "/tmp/mihomo_last_restart.log"
 RESTART_CMD = "xkeen -restart > " + LOG_FILE + " 2>&1"
+# Локальная копия Ace (скачивается mhstudio при установке), чтобы редактор
+# работал без доступа к CDN
+STATIC_DIR = "/opt/share/mihomo_studio"
+ACE_VERSION = "1.32.7"
+ACE_DIR = os.path.join(STATIC_DIR, "ace", ACE_VERSION)
+ACE_URL = "/static/ace/" + ACE_VERSION
+ACE_CDN = "https://cdnjs.cloudflare.com/ajax/libs/ace/" + ACE_VERSION
+STATIC_CACHE_CTL = "public, max-age=31536000, immutable"
+# Сжатие HTML/JSON ответов: не трогаем мелкие ответы, уровень - компромисс CPU/размер
+GZIP_MIN = 1024
+GZIP_LEVEL = int(os.environ.get("MHSTUDIO_GZIP_LEVEL", 5))
+# Сколько запросов обслуживается одновременно (остальные ждут свободного обработчика)
+MAX_WORKERS = int(os.environ.get("MHSTUDIO_WORKERS", 32))
+WORKER_WAIT = 10  # сек ожидания обработчика, затем 503
+# Долгие ответы (SSE, WebSocket, потоки /mihomo_panel/) обработчик не держат, у них свой лимит
+MAX_STREAMS = int(os.environ.get("MHSTUDIO_STREAMS", 32))
+# Открытых соединений, включая простаивающие keep-alive; сверх лимита - сразу 503
+MAX_CONNECTIONS = int(os.environ.get("MHSTUDIO_CONNECTIONS", 128))
+# Keep-alive для собственных ответов студии
+KEEPALIVE_IDLE = 15  # сек простоя, после которых соединение закрывается
+KEEPALIVE_MAX = 100  # запросов на одно соединение
+# Размер куска при потоковой проксировке /mihomo_panel/ (память на поток постоянна)
+PROXY_CHUNK = 16 * 1024
+WS_IDLE = 300  # сек без кадров в обе стороны, после которых WebSocket-туннель закрывается
+# Hop-by-hop заголовки не пересылаются между клиентом и контроллером
+HOP_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'te', 'trailer', 'upgrade'}
+# Пул keep-alive соединений к external-controller
+POOL_SIZE = 4
+POOL_IDLE = 30  # сек, после простоя соединение закрывается
+# cProfile запросов: MHSTUDIO_PROFILE=1 - всех, иначе только с ?cprofile=1; статистика в PROFILE_DIR
+PROFILE_ALL = os.environ.get("MHSTUDIO_PROFILE") == "1"
+PROFILE_DIR = "/tmp"
 
 # --- ИНИЦИАЛИЗАЦИЯ ---
 if not os.path.exists(BACKUP_DIR): os.makedirs(BACKUP_DIR)
@@ -216,6 +264,181 @@ def parse_wireguard(config_text, custom_name=None):
         return None, str(e)
 
 
+# --- ПОДПИСКИ ---
+# Реестр парсеров share-ссылок: схема -> parser(link) -> (data, error)
+LINK_PARSERS = {
+    'vless': parse_vless,
+}
+SUB_CHUNK = 64 * 1024
+
+
+def iter_sub_lines(chunks):
+    """Строки подписки из потока байт: обычный текст или base64 (в т.ч. urlsafe и без '=').
+
+    Обрабатывает данные по мере поступления, в памяти держится только
+    текущая неполная строка и хвост base64 короче 4 символов.
+    """
+    mode = None
+    head = b''
+    b64 = b''
+    buf = b''
+    for chunk in chunks:
+        if mode is None:
+            head += chunk
+            if len(head.strip()) < 16: continue
+            # В алфавите base64 нет ':', а в любой ссылке есть "://"
+            mode = 'plain' if b':' in head.lstrip()[:256] or head.lstrip()[:1] == b'#' else 'b64'
+            chunk, head = head, b''
+        if mode == 'b64':
+            b64 += chunk.translate(None, b' \t\r\n')
+            n = len(b64) // 4 * 4
+            try:
+                buf += base64.b64decode(b64[:n], altchars=b'-_') if n else b''
+            except binascii.Error:
+                raise ValueError('Invalid base64')
+            b64 = b64[n:]
+        else:
+            buf += chunk
+        *lines, buf = buf.split(b'\n')
+        for l in lines:
+            yield l.decode('utf-8', 'replace')
+    if mode is None:
+        # Подписка короче 16 байт
+        buf = head
+        mode = 'plain' if b':' in head else 'b64'
+        if mode == 'b64': b64, buf = head.translate(None, b' \t\r\n'), b''
+    if b64:
+        try:
+            buf += base64.b64decode(b64 + b'=' * (-len(b64) % 4), altchars=b'-_')
+        except binascii.Error:
+            raise ValueError('Invalid base64')
+        *lines, buf = buf.split(b'\n')
+        for l in lines:
+            yield l.decode('utf-8', 'replace')
+    if buf: yield buf.decode('utf-8', 'replace')
+
+
+def decode_subscription(chunks):
+    """Лениво разбирает подписку: {'line', 'name', 'yaml'} или {'line', 'link', 'error'}."""
+    for n, line in enumerate(iter_sub_lines(chunks), 1):
+        line = line.strip()
+        if not line or line.startswith('#'): continue
+        scheme = line.split('://', 1)[0].lower() if '://' in line else ''
+        parser = LINK_PARSERS.get(scheme)
+        if parser is None:
+            yield {'line': n, 'link': line[:64], 'error': 'Unsupported link: ' + (scheme or '?')}
+            continue
+        d, e = parser(line)
+        if d:
+            yield {'line': n, 'name': d['name'], 'yaml': d['yaml']}
+        else:
+            yield {'line': n, 'link': line[:64], 'error': e}
+
+
+# --- АРХИВЫ WIREGUARD ---
+WG_ARCHIVE_MAX = 8 * 1024 * 1024  # размер загружаемого архива
+WG_CONF_MAX = 64 * 1024  # размер одного .conf внутри архива
+WG_UNPACK_MAX = 32 * 1024 * 1024  # всего распакованных байт (tar.gz распаковывается целиком, включая не-.conf)
+# Чем может оборваться чтение битого архива: неизвестное сжатие, шифрование, испорченный deflate
+WG_ARCHIVE_ERRORS = (tarfile.TarError, zipfile.BadZipFile, EOFError, OSError, RuntimeError, zlib.error)
+
+
+class BodyReader:
+    """Файловый интерфейс к телу запроса, ограниченный Content-Length."""
+
+    def __init__(s, rfile, length):
+        s.rfile = rfile
+        s.left = length
+        s.head = b''
+
+    def peek(s, n):
+        if len(s.head) < n: s.head += s.raw(n - len(s.head))
+        return s.head[:n]
+
+    def raw(s, n):
+        n = s.left if n is None or n < 0 else min(n, s.left)
+        buf = s.rfile.read(n) if n > 0 else b''
+        s.left -= len(buf)
+        return buf
+
+    def read(s, n=-1):
+        if n is None or n < 0:
+            buf, s.head = s.head + s.raw(-1), b''
+            return buf
+        if s.head:
+            buf, s.head = s.head[:n], s.head[n:]
+            return buf
+        return s.raw(n)
+
+
+def iter_wg_archive(fileobj):
+    """(имя файла, текст, ошибка) для каждого *.conf в zip или tar(.gz/.bz2/.xz).
+
+    tar читается потоком без перемотки; zip требует произвольного доступа,
+    поэтому сначала сбрасывается во временный файл (в памяти до 1 МБ).
+    Сверх WG_UNPACK_MAX распакованных байт чтение останавливается.
+    """
+    total = 0
+    if fileobj.peek(4) == b'PK\x03\x04':
+        with tempfile.SpooledTemporaryFile(max_size=1024 * 1024, dir='/tmp') as spool:
+            shutil.copyfileobj(fileobj, spool, PROXY_CHUNK)
+            spool.seek(0)
+            with zipfile.ZipFile(spool) as zf:
+                for zi in zf.infolist():
+                    if zi.is_dir() or not zi.filename.lower().endswith('.conf'): continue
+                    if zi.file_size > WG_CONF_MAX:
+                        yield zi.filename, None, 'File too large'
+                        continue
+                    total += zi.file_size
+                    if total > WG_UNPACK_MAX:
+                        yield zi.filename, None, 'Archive too large when unpacked'
+                        return
+                    try:
+                        yield zi.filename, zf.read(zi).decode('utf-8', 'replace'), None
+                    except WG_ARCHIVE_ERRORS as e:
+                        yield zi.filename, None, 'Unreadable entry: ' + str(e)
+        return
+    with tarfile.open(fileobj=fileobj, mode='r|*') as tf:
+        for m in tf:
+            # Данные любого члена распаковываются хотя бы при пропуске, поэтому считаются все
+            total += m.size
+            if total > WG_UNPACK_MAX:
+                yield m.name, None, 'Archive too large when unpacked'
+                return
+            if not m.isfile() or not m.name.lower().endswith('.conf'): continue
+            if m.size > WG_CONF_MAX:
+                yield m.name, None, 'File too large'
+                continue
+            yield m.name, tf.extractfile(m).read().decode('utf-8', 'replace'), None
+
+
+def parse_wg_archive(fileobj, existing=()):
+    """Разбирает все .conf архива через parse_wireguard.
+
+    Имя прокси - имя файла без .conf. Коллизии имён (внутри архива и с уже
+    существующими прокси) помечаются ошибкой до вставки в конфиг.
+    """
+    items = []
+    for fname, text, err in iter_wg_archive(fileobj):
+        stem = os.path.splitext(os.path.basename(fname))[0]
+        if err:
+            items.append({'file': fname, 'name': stem, 'error': err})
+            continue
+        d, e = parse_wireguard(text, stem)
+        if d:
+            items.append({'file': fname, 'name': d['name'], 'yaml': d['yaml']})
+        else:
+            items.append({'file': fname, 'name': stem, 'error': e})
+    seen = set(existing)
+    for it in items:
+        if 'error' in it: continue
+        if it['name'] in seen:
+            it['error'] = 'Name collision: ' + it['name']
+            del it['yaml']
+        seen.add(it['name'])
+    return items
+
+
 def insert_proxy_logic(content, proxy_name, target_groups):
     lines = content.splitlines()
     new_lines = []
@@ -356,13 +579,1194 @@ def replace_proxy_block(content, target_name, new_yaml_lines):
     return "\n".join(new_content_lines)
 
 
+def rename_proxy(content, old_name, new_name):
+    """Переименовывает прокси в определении, в списках групп и в inline-списках."""
+    # 1. Замена в определении прокси: - name: "old_name"
+    # Regex для поиска `name: 'old_name'`, `name: "old_name"` или `name: old_name`
+    # Используем `re.escape` для безопасности
+    escaped_old = re.escape(old_name)
+    # (?P<quote>['"]?) - захватывает кавычку (если она есть) в группу 'quote'
+    # \\1 - ссылается на захваченную кавычку, чтобы заменить на такую же
+    pattern_def = r"(name\s*:\s*)(?P<quote>['\"]?)" + escaped_old + r"(?P=quote)"
+    # Заменяем, сохраняя оригинальные кавычки
+    content = re.sub(pattern_def, r'\g<1>"' + new_name + '"', content, count=1)
+
+    # 2. Замена в списках proxy-groups: - "old_name"
+    # Regex для поиска `- 'old_name'`, `- "old_name"` или `- old_name`
+    pattern_list = r"(-\s+)(?P<quote>['\"]?)" + escaped_old + r"(?P=quote)"
+    content = re.sub(pattern_list, r'\g<1>"' + new_name + '"', content)
+
+    # 3. Замена в Inline Lists: [ ..., "old_name", ... ]
+    # Ищем old_name внутри delimiters [ или , с последующим , или ]
+    pattern_inline = r"([\[,]\s*)(?P<q>['\"]?)" + escaped_old + r"(?P=q)(\s*[,\]])"
+    content = re.sub(pattern_inline, r'\1\g<q>' + new_name + r'\g<q>\3', content)
+    return content
+
+
+CONFIG_LOCK = threading.Lock()
+
+
+def config_version(content):
+    """Версия конфига для инкрементального сохранения - хэш содержимого."""
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def apply_line_edits(content, edits):
+    """Применяет правки [{start, del, lines}] (номера строк относительно base)."""
+    lines = content.split('\n')
+    prev = len(lines)
+    for e in sorted(edits, key=lambda e: int(e['start']), reverse=True):
+        start, n = int(e['start']), int(e['del'])
+        if start < 0 or n < 0 or start + n > prev:
+            raise ValueError('Edit out of range')
+        lines[start:start + n] = [str(l) for l in e['lines']]
+        prev = start
+    return '\n'.join(lines)
+
+
+def line_edits(old_c, new_c):
+    """Правки [{start, del, lines}], превращающие old_c в new_c (формат apply_line_edits)."""
+    a, b = old_c.split('\n'), new_c.split('\n')
+    p = 0
+    while p < len(a) and p < len(b) and a[p] == b[p]: p += 1
+    q = 0
+    while q < len(a) - p and q < len(b) - p and a[-1 - q] == b[-1 - q]: q += 1
+    a_mid, b_mid = a[p:len(a) - q], b[p:len(b) - q]
+    # Без autojunk точнее, но на больших участках квадратично
+    sm = difflib.SequenceMatcher(None, a_mid, b_mid, autojunk=len(a_mid) + len(b_mid) > 4000)
+    return [{'start': p + i1, 'del': i2 - i1, 'lines': b_mid[j1:j2]}
+            for op, i1, i2, j1, j2 in sm.get_opcodes() if op != 'equal']
+
+
+def config_key():
+    """Ключ версии активного профиля по stat() цели симлинка (None, если файла нет)."""
+    try:
+        real = os.path.realpath(CONFIG_PATH)
+        st = os.stat(real)
+    except OSError:
+        return None
+    return (real, st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+TOP_KEY_RE = re.compile(r'^([A-Za-z0-9_.-]+)\s*:')
+FLOW_NAME_RE = re.compile(r'\bname:\s*([^,}]+)')
+
+
+def yaml_scalar(v):
+    v = v.strip()
+    if len(v) >= 2 and v[0] == v[-1] == '"':
+        try:
+            return json.loads(v)  # экранирование \" \\ \uXXXX как в yaml_quote
+        except ValueError:
+            return v[1:-1]
+    if len(v) >= 2 and v[0] == v[-1] == "'": return v[1:-1].replace("''", "'")
+    return v.split(' #')[0].strip().strip('"\'')
+
+
+def yaml_quote(v):
+    """Строка в YAML в двойных кавычках: JSON-строка - валидный YAML-скаляр."""
+    return json.dumps(v, ensure_ascii=False)
+
+
+def list_items(lines, a, b):
+    """Элементы YAML-списка в строках [a, b): [{'start', 'end', 'name', 'indent'}]."""
+    items = []
+    ind = None
+    for i in range(a, b):
+        l = lines[i]
+        st = l.lstrip()
+        if not st or st[0] == '#': continue
+        n = len(l) - len(st)
+        if st[0] == '-' and (ind is None or n == ind) and (len(st) == 1 or st[1] in ' {'):
+            ind = n
+            if items: items[-1]['end'] = i
+            rest = st[1:].strip()
+            name = None
+            if rest.startswith('{'):
+                m = FLOW_NAME_RE.search(rest)
+                if m: name = yaml_scalar(m.group(1))
+            elif rest.startswith('name:'):
+                name = yaml_scalar(rest[5:])
+            items.append({'start': i, 'end': b, 'name': name, 'indent': n})
+        elif items and items[-1]['name'] is None and n == ind + 2 and st.startswith('name:'):
+            items[-1]['name'] = yaml_scalar(st[5:])
+    for it in items:
+        # Хвостовые пустые строки к блоку не относятся
+        while it['end'] - 1 > it['start'] and not lines[it['end'] - 1].strip():
+            it['end'] -= 1
+    return items
+
+
+def group_members(lines, item):
+    """Состав группы: строка ключа proxies:, inline ли список и [{'name', 'line'}]."""
+    key_ind = item['indent'] + 2
+    for i in range(item['start'], item['end']):
+        l = lines[i]
+        st = l.lstrip()
+        body = st[1:].lstrip() if i == item['start'] else st
+        if not body.startswith('proxies:'): continue
+        tail = body[8:].split(' #')[0].strip()
+        if tail.startswith('['):
+            inner = tail[1:tail.rfind(']')] if ']' in tail else tail[1:]
+            names = [yaml_scalar(x) for x in inner.split(',') if x.strip()]
+            return {'proxies_line': i, 'inline': True, 'members': [{'name': x, 'line': i} for x in names]}
+        members = []
+        for j in range(i + 1, item['end']):
+            ml = lines[j]
+            mst = ml.lstrip()
+            if not mst or mst[0] == '#': continue
+            if len(ml) - len(mst) < key_ind or (len(ml) - len(mst) == key_ind and mst[0] != '-'): break
+            if mst[0] == '-': members.append({'name': yaml_scalar(mst[1:]), 'line': j})
+        return {'proxies_line': i, 'inline': False, 'members': members}
+    return {'proxies_line': None, 'inline': False, 'members': []}
+
+
+class ConfigIndex:
+    """Структурный индекс конфига: секции верхнего уровня, прокси, группы и правила.
+
+    Номера строк 0-based, конец диапазона не включается. Разобранные данные
+    секции хранятся относительно её начала, поэтому правка в одной секции
+    сдвигает остальные без повторного разбора (apply_edits), а внутри списка
+    прокси или групп перечитываются только задетые элементы (patch).
+    """
+
+    def __init__(s, content, version=None):
+        s.lines = content.split('\n')
+        s.version = version or config_version(content)
+        s.sections = s.scan(0, len(s.lines))
+        s.close_ends()
+
+    def scan(s, a, b):
+        secs = []
+        for i in range(a, b):
+            m = TOP_KEY_RE.match(s.lines[i])
+            if m: secs.append({'name': m.group(1), 'start': i, 'end': b, 'data': None})
+        for k, sec in enumerate(secs[:-1]): sec['end'] = secs[k + 1]['start']
+        for sec in secs: s.parse(sec)
+        return secs
+
+    def close_ends(s):
+        for k, sec in enumerate(s.sections):
+            sec['end'] = s.sections[k + 1]['start'] if k + 1 < len(s.sections) else len(s.lines)
+
+    def entries(s, sec, items):
+        """Элементы list_items -> данные секции относительно её начала (безымянные пропускаются)."""
+        a = sec['start']
+        rel = lambda d: {k: (v - a if k in ('start', 'end', 'line', 'proxies_line') and v is not None else v)
+                         for k, v in d.items()}
+        out = []
+        for it in items:
+            if it['name'] is None: continue
+            if sec['name'] == 'proxy-groups':
+                it = dict(it, **group_members(s.lines, it))
+                it['members'] = [rel(m) for m in it['members']]
+            out.append(rel(it))
+        return out
+
+    def parse(s, sec):
+        a, b = sec['start'], sec['end']
+        if sec['name'] in ('proxies', 'proxy-groups'):
+            sec['data'] = s.entries(sec, list_items(s.lines, a + 1, b))
+        elif sec['name'] == 'rules':
+            sec['data'] = sum(1 for i in range(a + 1, b) if s.lines[i].lstrip().startswith('-'))
+
+    def patch(s, sec, start, n, new):
+        """Правка внутри тела одной секции без новых ключей верхнего уровня.
+
+        Перечитываются элементы от последнего, начавшегося до правки, до первого
+        после неё; у следующих только сдвигаются номера строк. False - правка
+        задевает заголовок или границы секции, её применяет apply_edits целиком.
+        """
+        a, b = sec['start'], sec['end']
+        if start <= a or start + n > b or any(TOP_KEY_RE.match(l) for l in new): return False
+        delta, old = len(new) - n, s.lines[start:start + n]
+        data = sec['data']
+        if sec['name'] == 'rules':
+            dash = lambda ls: sum(1 for l in ls if l.lstrip().startswith('-'))
+            sec['data'] += dash(new) - dash(old)
+        elif sec['name'] in ('proxies', 'proxy-groups') and data:
+            starts = [d['start'] for d in data]  # bisect(key=) есть только с Python 3.10
+            i0 = bisect.bisect_left(starts, start - a) - 1
+            i1 = bisect.bisect_left(starts, start + n - a)
+            ra = a + data[i0]['start'] if i0 >= 0 else a + 1
+            rb = a + data[i1]['start'] + delta if i1 < len(data) else b + delta
+            s.lines[start:start + n] = new
+            items = list_items(s.lines, ra, rb)
+            if any(it['indent'] != data[0]['indent'] for it in items):
+                # Сменился отступ элементов списка - частичный разбор тут не годится
+                s.lines[start:start + len(new)] = old
+                return False
+            for d in data[i1:]:
+                for k in ('start', 'end', 'line', 'proxies_line'):
+                    if d.get(k) is not None: d[k] += delta
+                for m in d.get('members', ()): m['line'] += delta
+            data[max(i0, 0):i1] = s.entries(sec, items)
+            sec['end'] += delta
+            return True
+        s.lines[start:start + n] = new
+        sec['end'] += delta
+        if sec['name'] in ('proxies', 'proxy-groups'): s.parse(sec)  # в списке ещё нет элементов
+        return True
+
+    def section_at(s, line):
+        k = -1
+        for j, sec in enumerate(s.sections):
+            if sec['start'] <= line: k = j
+            else: break
+        return k
+
+    def apply_edits(s, edits, version=None):
+        """Правки как в apply_line_edits; перечитываются только затронутые элементы или секции."""
+        for e in sorted(edits, key=lambda e: int(e['start']), reverse=True):
+            start, n, new = int(e['start']), int(e['del']), [str(l) for l in e['lines']]
+            k = s.section_at(start)
+            if k >= 0 and s.patch(s.sections[k], start, n, new):
+                for sec in s.sections[k + 1:]:
+                    sec['start'] += len(new) - n
+                    sec['end'] += len(new) - n
+                continue
+            s.lines[start:start + n] = new
+            delta = len(new) - n
+            first = s.section_at(start)
+            last = max(first, s.section_at(max(start + n - 1, start)))
+            a = s.sections[first]['start'] if first >= 0 else 0
+            if first > 0 and (a >= len(s.lines) or not TOP_KEY_RE.match(s.lines[a])):
+                # Удалён ключ секции - её строки отходят предыдущей секции
+                first -= 1
+                a = s.sections[first]['start']
+            b = (s.sections[last]['end'] if last >= 0 else (s.sections[0]['start'] if s.sections else len(s.lines) - delta)) + delta
+            for sec in s.sections[last + 1:]:
+                sec['start'] += delta
+                sec['end'] += delta
+            s.sections[max(first, 0):last + 1] = s.scan(a, b)
+            s.close_ends()
+        s.version = version or config_version('\n'.join(s.lines))
+
+    def section(s, name):
+        for sec in s.sections:
+            if sec['name'] == name: return sec
+        return None
+
+    def proxies(s):
+        sec = s.section('proxies')
+        if not sec or not sec['data']: return []
+        a = sec['start']
+        return [{'name': p['name'], 'start': a + p['start'], 'end': a + p['end']} for p in sec['data']]
+
+    def groups(s):
+        sec = s.section('proxy-groups')
+        if not sec or not sec['data']: return []
+        a = sec['start']
+        res = []
+        for g in sec['data']:
+            res.append({'name': g['name'], 'start': a + g['start'], 'end': a + g['end'],
+                        'proxies_line': None if g['proxies_line'] is None else a + g['proxies_line'],
+                        'inline': g['inline'],
+                        'members': [{'name': m['name'], 'line': a + m['line']} for m in g['members']]})
+        return res
+
+    def outline(s):
+        rules = s.section('rules')
+        return {'version': s.version, 'lines': len(s.lines),
+                'sections': [{'name': x['name'], 'start': x['start'], 'end': x['end']} for x in s.sections],
+                'proxies': s.proxies(), 'proxy-groups': s.groups(),
+                'rules': {'start': rules['start'], 'end': rules['end'], 'count': rules['data']} if rules else None}
+
+
+_idx_cache = {'key': None, 'idx': None}
+_idx_lock = threading.Lock()
+
+
+def config_index():
+    """Индекс активного профиля; строится один раз на версию файла."""
+    key = config_key()
+    with _idx_lock:
+        if key is not None and _idx_cache['key'] == key:
+            return _idx_cache['idx']
+        c = ''
+        if key is not None:
+            with open(key[0], 'r', encoding='utf-8') as f:
+                c = f.read()
+        idx = ConfigIndex(c)
+        _idx_cache['key'], _idx_cache['idx'] = key, idx
+        return idx
+
+
+def index_after_patch(base, edits, new_c):
+    """Обновляет закэшированный индекс после save_patch вместо полного разбора."""
+    with _idx_lock:
+        idx = _idx_cache['idx']
+        if idx is None or idx.version != base: return
+        idx.apply_edits(edits, config_version(new_c))
+        _idx_cache['key'] = config_key()
+
+
+def insert_proxies_batch(content, items, targets):
+    """Вставляет много прокси и их членство в группах за один проход по строкам.
+
+    items - [{'name', 'yaml'}], targets - имена групп. Возвращает
+    (новый текст, отчёт по каждому прокси, отчёт по группам).
+    """
+    idx = ConfigIndex(content)
+    lines = idx.lines
+    before = {}  # номер строки -> строки, вставляемые перед ней
+    replace = {}  # номер строки -> новая строка
+    existing = {p['name'] for p in idx.proxies()}
+    report, names, blocks = [], [], []
+    for it in items:
+        if not isinstance(it, dict):
+            report.append({'name': '', 'status': 'error', 'error': 'Item is not an object'})
+            continue
+        name = str(it.get('name') or '').strip()
+        y = str(it.get('yaml') or '')
+        if not name or not y.strip():
+            report.append({'name': name, 'status': 'error', 'error': it.get('error') or 'Empty proxy'})
+        elif name in existing:
+            report.append({'name': name, 'status': 'duplicate'})
+        else:
+            existing.add(name)
+            names.append(name)
+            blocks.append(y.splitlines())
+            report.append({'name': name, 'status': 'ok'})
+    if not names:
+        return content, report, {}
+
+    sec = idx.section('proxies')
+    prs = idx.proxies()
+    ind = len(lines[prs[0]['start']]) - len(lines[prs[0]['start']].lstrip()) if prs else 2
+    new_lines = [" " * ind + bl for blk in blocks for bl in blk]
+    if sec:
+        if lines[sec['start']].split('#')[0].strip().replace(' ', '') == 'proxies:[]':
+            replace[sec['start']] = 'proxies:'
+        before.setdefault(sec['start'] + 1, []).extend(new_lines)
+    else:
+        before.setdefault(len(lines), []).extend(['proxies:'] + new_lines)
+
+    groups = {}
+    for g in idx.groups():
+        if g['name'] not in targets: continue
+        have = {m['name'] for m in g['members']}
+        add = [n for n in names if n not in have]
+        pl = g['proxies_line']
+        if pl is None:
+            groups[g['name']] = 'no proxies list'
+            continue
+        groups[g['name']] = len(add)
+        if not add: continue
+        if g['inline']:
+            line = lines[pl]
+            st, en = line.find('['), line.rfind(']')
+            inner = line[st + 1:en]
+            sep = ", " if inner.strip() else ""
+            replace[pl] = line[:st + 1] + inner + sep + ", ".join(yaml_quote(n) for n in add) + line[en:]
+            continue
+        ms = g['members']
+        if ms:
+            m_ind = len(lines[ms[0]['line']]) - len(lines[ms[0]['line']].lstrip())
+            # Как insert_proxy_logic: перед DIRECT/REJECT, иначе в конец списка
+            pos = next((m['line'] for m in ms if 'DIRECT' in m['name'] or 'REJECT' in m['name']), ms[-1]['line'] + 1)
+        else:
+            m_ind = len(lines[pl]) - len(lines[pl].lstrip()) + 2
+            pos = pl + 1
+        before.setdefault(pos, []).extend(" " * m_ind + '- ' + yaml_quote(n) for n in add)
+    for t in targets:
+        groups.setdefault(t, 'not found')
+
+    out = []
+    for i, line in enumerate(lines):
+        if i in before: out.extend(before[i])
+        out.append(replace.get(i, line))
+    out.extend(before.get(len(lines), ()))
+    return "\n".join(out), report, groups
+
+
+# --- БЭКАПЫ ---
+BACKUP_NAME_RE = re.compile(r'^(.*)_(\d{8}_\d{6})\.yaml$')
+
+
+class BackupStore:
+    """Бэкапы как gzip-объекты, адресуемые SHA-1 содержимого, и журнал manifest.jsonl.
+
+    Последняя версия профиля и каждая BACKUP_KEYFRAME-я хранятся целиком
+    (blobs/<hash>.gz), остальные - обратной построчной разницей к следующей
+    версии (blobs/<hash>-<base>.gz), так что любая версия собирается не
+    больше чем за BACKUP_KEYFRAME шагов. Журнал только дописывается (записи
+    add/del) и периодически уплотняется. Имена записей совпадают со старыми
+    файлами <профиль>_<дата>_<время>.yaml.
+    """
+
+    def __init__(s, root):
+        s.root = root
+        s.blobs = os.path.join(root, 'blobs')
+        s.manifest = os.path.join(root, 'manifest.jsonl')
+        s.lock = threading.RLock()
+        s.entries = {}  # name -> {'name', 'profile', 'ts', 'hash', 'size', 'seq'}
+        s.order = []  # записи по возрастанию ts
+        s.objs = {}  # hash -> None (целиком) или hash версии, от которой хранится разница
+        s.seqs = {}  # profile -> номер последней версии
+        s.records = 0  # строк в журнале (для уплотнения)
+        s.stamp = None  # метаданные каталога и журнала на момент последнего чтения/записи
+
+    def load(s):
+        os.makedirs(s.blobs, exist_ok=True)
+        with s.lock:
+            s.entries, s.records = {}, 0
+            try:
+                with open(s.manifest, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            rec = json.loads(line)
+                        except ValueError:
+                            continue  # недописанная строка после сбоя питания
+                        s.records += 1
+                        if rec.get('op') == 'del':
+                            s.entries.pop(rec['name'], None)
+                        else:
+                            rec.pop('op', None); rec.setdefault('seq', 0)
+                            s.entries[rec['name']] = rec
+            except OSError:
+                pass
+            s.order = sorted(s.entries.values(), key=lambda e: e['ts'])
+            s.seqs = {}
+            for e in s.order:
+                s.seqs[e['profile']] = max(s.seqs.get(e['profile'], 0), e['seq'])
+            s.objs = {}
+            for fn in os.listdir(s.blobs):
+                if not fn.endswith('.gz'): continue
+                h, _, base = fn[:-3].partition('-')
+                if base and s.objs.get(h, base) is None: continue  # целая копия важнее разницы
+                s.objs[h] = base or None
+            s.migrate()
+            s.stamp = s.disk_stamp()
+
+    def disk_stamp(s):
+        try:
+            d, m = os.stat(s.root), os.stat(s.manifest)
+            return (d.st_mtime_ns, m.st_ino, m.st_mtime_ns, m.st_size)
+        except OSError:
+            return None
+
+    def refresh(s):
+        """Перечитывает журнал, только если каталог или журнал изменили извне."""
+        with s.lock:
+            if s.disk_stamp() != s.stamp: s.load()
+
+    def migrate(s):
+        """Переносит старые несжатые *.yaml из BACKUP_DIR в хранилище."""
+        legacy = []
+        for path in glob.glob(os.path.join(s.root, '*.yaml')):
+            m = BACKUP_NAME_RE.match(os.path.basename(path))
+            try:
+                ts = datetime.strptime(m.group(2), '%Y%m%d_%H%M%S').timestamp() if m else os.path.getmtime(path)
+            except (OSError, ValueError):
+                continue
+            legacy.append((ts, path, m))
+        for ts, path, m in sorted(legacy):  # по времени, чтобы разницы шли от новых к старым
+            name = os.path.basename(path)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                s.add(m.group(1) if m else os.path.splitext(name)[0], data, ts, name, dedupe=False)
+                os.remove(path)
+            except OSError:
+                pass
+
+    def obj_path(s, h, base=None):
+        return os.path.join(s.blobs, f"{h}-{base}.gz" if base else h + '.gz')
+
+    def write_obj(s, h, base, payload):
+        path = s.obj_path(h, base)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(gzip.compress(payload, 9))
+        os.replace(tmp, path)
+        old = s.objs.get(h, '')
+        s.objs[h] = base
+        if old != '' and old != base:
+            try:
+                os.remove(s.obj_path(h, old))
+            except OSError:
+                pass
+
+    def text(s, h):
+        """Содержимое объекта: ближайшая целая копия плюс цепочка обратных разниц."""
+        chain = []
+        while s.objs.get(h):
+            base = s.objs[h]
+            with open(s.obj_path(h, base), 'rb') as f:
+                chain.append(json.loads(gzip.decompress(f.read())))
+            h = base
+            if len(chain) > 10000: raise ValueError('Backup delta loop')
+        with open(s.obj_path(h), 'rb') as f:
+            c = gzip.decompress(f.read()).decode('utf-8', 'surrogateescape')
+        for edits in reversed(chain):
+            c = apply_line_edits(c, edits)
+        return c
+
+    def append(s, rec):
+        with open(s.manifest, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(rec) + '\n')
+        s.records += 1
+        s.stamp = s.disk_stamp()
+
+    def unlink(s, name):
+        e = s.entries.pop(name, None)
+        if e is not None: s.order.remove(e)
+        return e
+
+    def add(s, profile, data, ts=None, name=None, dedupe=True):
+        """Сохраняет версию профиля. Повтор последней версии профиля ничего не пишет."""
+        ts = ts or time.time()
+        with s.lock:
+            h = hashlib.sha1(data).hexdigest()
+            last = s.latest(1, profile)
+            last = last[0] if last else None
+            if dedupe and last and last['hash'] == h: return last
+            if not name:
+                # Несколько сохранений за секунду не должны затирать друг друга
+                base, i = f"{profile}_{datetime.fromtimestamp(ts).strftime('%Y%m%d_%H%M%S')}", 0
+                name = base + '.yaml'
+                while name in s.entries:
+                    i += 1; name = f"{base}_{i}.yaml"
+            # Новая голова цепочки всегда хранится целиком
+            if s.objs.get(h, '') is not None: s.write_obj(h, None, data)
+            if last and last['ts'] <= ts: s.demote(last, h, data)
+            seq = s.seqs.get(profile, 0) + 1
+            s.seqs[profile] = seq
+            entry = {'name': name, 'profile': profile, 'ts': ts, 'hash': h, 'size': len(data), 'seq': seq}
+            s.unlink(name)
+            s.entries[name] = entry
+            i = len(s.order)
+            while i and s.order[i - 1]['ts'] > ts: i -= 1  # обычно новая запись - самая свежая
+            s.order.insert(i, entry)
+            s.append(dict(entry, op='add'))
+            return entry
+
+    def demote(s, prev, h, data):
+        """Заменяет целую копию бывшей головы разницей от новой версии (кроме ключевых)."""
+        ph = prev['hash']
+        if ph == h or prev['seq'] % BACKUP_KEYFRAME == 0 or s.objs.get(ph, '') is not None: return
+        for p in s.seqs:
+            head = s.latest(1, p)
+            if p != prev['profile'] and head and head[0]['hash'] == ph: return  # голова другого профиля
+        new_c = data.decode('utf-8', 'surrogateescape')
+        edits = line_edits(new_c, s.text(ph))
+        s.write_obj(ph, h, json.dumps(edits).encode('utf-8'))
+
+    def read(s, name):
+        with s.lock:
+            e = s.entries.get(name)
+            if e is None: return None
+            return s.text(e['hash']).encode('utf-8', 'surrogateescape')
+
+    def diff(s, name, other, other_c=None):
+        """Unified diff между двумя бэкапами (other_c - готовый текст, например текущий конфиг)."""
+        with s.lock:
+            a, b = s.entries.get(name), s.entries.get(other)
+            if a is None or (b is None and other_c is None): return None
+            old_c = s.text(a['hash'])
+            new_c = other_c if other_c is not None else s.text(b['hash'])
+        return '\n'.join(difflib.unified_diff(old_c.split('\n'), new_c.split('\n'), name,
+                                              other if other_c is None else 'current', lineterm=''))
+
+    def latest(s, n=None, profile=None):
+        items = [e for e in reversed(s.order) if profile is None or e['profile'] == profile]
+        return items if n is None else items[:n]
+
+    def page(s, offset=0, limit=10, profile=None, q=None):
+        """Страница списка (новые сверху) с фильтром по профилю и подстроке имени."""
+        items = s.latest(None, profile or None)
+        if q: items = [e for e in items if q in e['name']]
+        return {'items': items[offset:offset + limit], 'total': len(items), 'offset': offset, 'limit': limit,
+                'profiles': sorted({e['profile'] for e in s.order})}
+
+    def remove(s, names):
+        with s.lock:
+            for name in names:
+                if s.unlink(name) is not None:
+                    s.append({'op': 'del', 'name': name})
+            s.gc()
+            if s.records > 2 * len(s.entries) + 50: s.compact()
+
+    def keep_latest(s, limit):
+        s.remove([e['name'] for e in s.latest()[limit:]])
+
+    def gc(s):
+        """Удаляет объекты, не нужные ни одной записи (с учётом баз разниц)."""
+        used, todo = set(), [e['hash'] for e in s.entries.values()]
+        while todo:
+            h = todo.pop()
+            if h in used: continue
+            used.add(h)
+            if s.objs.get(h): todo.append(s.objs[h])
+        for h in [h for h in s.objs if h not in used]:
+            try:
+                os.remove(s.obj_path(h, s.objs.pop(h)))
+            except OSError:
+                pass
+
+    def compact(s):
+        tmp = s.manifest + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for e in s.order:
+                f.write(json.dumps(dict(e, op='add')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, s.manifest)
+        s.records = len(s.entries)
+        s.stamp = s.disk_stamp()
+
+
+BACKUPS = BackupStore(BACKUP_DIR)
+
+
+def atomic_write(path, data, timing=None):
+    """Пишет файл через временный рядом: fsync и rename, при сбое остаётся старая версия.
+
+    path - цель симлинка, а не сам симлинк: rename заменяет файл профиля,
+    и config.yaml продолжает на него указывать.
+    """
+    timing = {} if timing is None else timing
+    t0 = time.monotonic()
+    # Уникальное имя: параллельные записи не делят один временный файл
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            t1 = time.monotonic()
+            f.flush(); os.fsync(f.fileno())
+        try:
+            shutil.copymode(path, tmp)
+        except OSError:
+            os.chmod(tmp, 0o644)  # mkstemp создаёт 0600, а новому профилю нужны обычные права
+        t2 = time.monotonic()
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    try:
+        fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+        try:
+            os.fsync(fd)  # сама запись о переименовании
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+    t3 = time.monotonic()
+    timing.update(write=(t1 - t0) * 1000, fsync=(t2 - t1) * 1000, rename=(t3 - t2) * 1000)
+    return timing
+
+
+def write_config(new_c):
+    """Бэкап активного профиля и атомарная запись нового содержимого.
+
+    Возвращает {'changed', 'timing'}; при совпадении содержимого ничего не пишет.
+    """
+    timing, t0 = {}, time.monotonic()
+    real = os.path.realpath(CONFIG_PATH)
+    data = new_c.encode('utf-8')
+    try:
+        with open(real, 'rb') as f:
+            cur = f.read()
+    except OSError:
+        cur = None
+    t1 = time.monotonic()
+    timing['read'] = (t1 - t0) * 1000
+    if cur == data:
+        return {'changed': False, 'timing': {k: round(v, 1) for k, v in timing.items()}}
+    if cur is not None:
+        BACKUPS.add(os.path.splitext(os.path.basename(real))[0], cur)
+    timing['backup'] = (time.monotonic() - t1) * 1000
+    atomic_write(real, data, timing)
+    return {'changed': True, 'timing': {k: round(v, 1) for k, v in timing.items()}}
+
+
+# --- ФОНОВЫЕ ЗАДАЧИ ---
+JOBS = {}
+JOBS_LOCK = threading.Lock()
+JOBS_KEEP = 10
+LOG_POLL = 0.3  # сек между проверками LOG_FILE при стриминге
+
+
+def run_restart(job):
+    my_env = os.environ.copy();
+    my_env["TERM"] = "xterm-256color"
+    try:
+        job['code'] = subprocess.run(RESTART_CMD, shell=True, env=my_env).returncode
+        job['state'] = 'done' if job['code'] == 0 else 'failed'
+    except Exception as e:
+        job['error'] = str(e)
+        job['state'] = 'failed'
+    job['finished'] = time.time()
+    job['duration'] = round(job['finished'] - job['started'], 2)
+    METRICS.observe('mhstudio_restart_seconds', (), job['finished'] - job['started'])
+    METRICS.inc('mhstudio_restarts_total', (('state', job['state']),))
+
+
+def start_restart_job():
+    """Запускает RESTART_CMD в фоне; пока идёт рестарт, повторный вызов вернёт ту же задачу."""
+    with JOBS_LOCK:
+        for job in JOBS.values():
+            if job['kind'] == 'restart' and job['state'] == 'running':
+                return job
+        job = {'id': os.urandom(6).hex(), 'kind': 'restart', 'state': 'running',
+               'started': time.time(), 'finished': None, 'duration': None, 'code': None}
+        JOBS[job['id']] = job
+        for old in list(JOBS)[:-JOBS_KEEP]:
+            del JOBS[old]
+    # Лог перезаписывается командой; обнуляем заранее, чтобы стрим не показал прошлый запуск
+    open(LOG_FILE, 'w').close()
+    threading.Thread(target=run_restart, args=(job,), daemon=True).start()
+    return job
+
+
+# --- HOT RELOAD ---
+# Секции, изменение которых mihomo не применяет через PUT /configs - нужен полный рестарт
+RESTART_KEYS = ('port', 'socks-port', 'mixed-port', 'redir-port', 'tproxy-port', 'listeners',
+                'tun', 'dns', 'external-controller')
+RELOAD_TIMEOUT = 30
+
+
+def restart_reason(old_c, new_c):
+    """Имя первой изменённой секции из RESTART_KEYS или None."""
+    old_i, new_i = ConfigIndex(old_c), ConfigIndex(new_c)
+    for key in RESTART_KEYS:
+        a, b = old_i.section(key), new_i.section(key)
+        if (a is None) != (b is None): return key
+        if a and old_i.lines[a['start']:a['end']] != new_i.lines[b['start']:b['end']]: return key
+    return None
+
+
+def controller_reload(content):
+    """PUT /configs?force=true с новым конфигом. Возвращает (ok, ошибка)."""
+    ctrl = controller_info()
+    if not ctrl['port']: return False, 'external-controller not found'
+    headers = {'Content-Type': 'application/json'}
+    if ctrl['secret']: headers['Authorization'] = 'Bearer ' + ctrl['secret']
+    conn = http.client.HTTPConnection(ctrl['host'], int(ctrl['port']), timeout=RELOAD_TIMEOUT)
+    try:
+        conn.request('PUT', '/configs?force=true', body=json.dumps({'path': '', 'payload': content}), headers=headers)
+        resp = conn.getresponse()
+        body = resp.read()
+        if resp.status in (200, 204): return True, None
+        try:
+            return False, json.loads(body).get('message') or str(resp.status)
+        except ValueError:
+            return False, f"HTTP {resp.status}"
+    except (OSError, http.client.HTTPException) as e:
+        return False, str(e)
+    finally:
+        conn.close()
+
+
+# --- МЕТРИКИ ---
+# Границы корзин гистограмм, секунды
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+METRIC_HELP = {
+    'mhstudio_requests_total': ('counter', 'Обработанные запросы по маршруту/действию и коду ответа'),
+    'mhstudio_request_seconds': ('histogram', 'Время обработки запроса (без ожидания keep-alive)'),
+    'mhstudio_request_bytes_total': ('counter', 'Байты тел запросов'),
+    'mhstudio_response_bytes_total': ('counter', 'Байты ответов, включая заголовки'),
+    'mhstudio_upstream_seconds': ('histogram', 'Время до ответа контроллера в /mihomo_panel/'),
+    'mhstudio_restart_seconds': ('histogram', 'Длительность RESTART_CMD'),
+    'mhstudio_restarts_total': ('counter', 'Рестарты по результату'),
+    'mhstudio_backups': ('gauge', 'Записей в журнале бэкапов'),
+    'mhstudio_backup_bytes': ('gauge', 'Размер бэкапов: logical - несжатый, stored - на диске'),
+    'process_resident_memory_bytes': ('gauge', 'Resident set size процесса'),
+    'process_cpu_seconds_total': ('counter', 'Процессорное время (user+system)'),
+    'process_start_time_seconds': ('gauge', 'Время запуска процесса, unix'),
+    'mhstudio_threads': ('gauge', 'Живых потоков'),
+    'mhstudio_rejected_total': ('counter', 'Ответы 503 по исчерпанному лимиту'),
+}
+
+
+class Metrics:
+    """Счётчики и гистограммы в памяти; на запрос - один захват блокировки."""
+
+    def __init__(s):
+        s.lock = threading.Lock()
+        s.counters = {}  # (имя, ((метка, значение), ...)) -> число
+        s.hists = {}  # (имя, метки) -> [корзины..., +Inf, сумма, количество]
+        s.started = time.time()
+
+    def inc(s, name, labels=(), v=1):
+        with s.lock:
+            s.counters[(name, labels)] = s.counters.get((name, labels), 0) + v
+
+    def _observe(s, name, labels, v):
+        h = s.hists.get((name, labels))
+        if h is None: h = s.hists[(name, labels)] = [0] * (len(METRIC_BUCKETS) + 3)
+        h[bisect.bisect_left(METRIC_BUCKETS, v)] += 1
+        h[-2] += v
+        h[-1] += 1
+
+    def observe(s, name, labels, v):
+        with s.lock:
+            s._observe(name, labels, v)
+
+    def request(s, route, code, secs, in_bytes, out_bytes):
+        lr = (('route', route),)
+        c = s.counters
+        with s.lock:
+            k = ('mhstudio_requests_total', lr + (('code', str(code)),))
+            c[k] = c.get(k, 0) + 1
+            k = ('mhstudio_request_bytes_total', lr)
+            c[k] = c.get(k, 0) + in_bytes
+            k = ('mhstudio_response_bytes_total', lr)
+            c[k] = c.get(k, 0) + out_bytes
+            s._observe('mhstudio_request_seconds', lr, secs)
+
+    @staticmethod
+    def fmt(labels):
+        if not labels: return ''
+        esc = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in labels) + '}'
+
+    def gauges(s):
+        """Значения, которые дешевле посчитать в момент запроса /metrics."""
+        g = {('mhstudio_backups', ()): len(BACKUPS.entries),
+             ('mhstudio_backup_bytes', (('kind', 'logical'),)): sum(e['size'] for e in BACKUPS.order),
+             ('process_start_time_seconds', ()): s.started,
+             ('mhstudio_threads', ()): threading.active_count()}
+        stored = 0
+        for h, base in list(BACKUPS.objs.items()):
+            try:
+                stored += os.path.getsize(BACKUPS.obj_path(h, base))
+            except OSError:
+                pass
+        g[('mhstudio_backup_bytes', (('kind', 'stored'),))] = stored
+        try:
+            with open('/proc/self/statm') as f:
+                g[('process_resident_memory_bytes', ())] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            pass
+        t = os.times()
+        g[('process_cpu_seconds_total', ())] = t.user + t.system
+        return g
+
+    def render(s):
+        with s.lock:
+            items = list(s.counters.items())
+            hists = [(k, list(h)) for k, h in s.hists.items()]
+        items += s.gauges().items()
+        by_name = {}
+        for (name, labels), v in items:
+            by_name.setdefault(name, []).append(f"{name}{s.fmt(labels)} {round(v, 6)!r}")
+        for (name, labels), h in hists:
+            rows, acc = by_name.setdefault(name, []), 0
+            for le, n in zip(METRIC_BUCKETS + ('+Inf',), h):
+                acc += n
+                rows.append(f"{name}_bucket{s.fmt(labels + (('le', le),))} {acc}")
+            rows.append(f"{name}_sum{s.fmt(labels)} {round(h[-2], 6)!r}")
+            rows.append(f"{name}_count{s.fmt(labels)} {h[-1]}")
+        out = []
+        for name in sorted(by_name):
+            kind, text = METRIC_HELP.get(name, ('untyped', name))
+            out += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"] + by_name[name]
+        return '\n'.join(out) + '\n'
+
+
+METRICS = Metrics()
+
+
+# Метки берутся только из этих списков: путь и act приходят от клиента
+METRIC_ROUTES = frozenset(('/', '/metrics', '/api/config', '/api/controller', '/api/delay', '/api/outline',
+                           '/api/profiles', '/api/backups', '/api/subscription', '/api/wg_archive'))
+METRIC_ACTIONS = frozenset(('switch_prof', 'add_prof', 'del_prof', 'get_prof_content', 'rename_proxy', 'parse',
+                            'add_wireguard', 'apply_insert', 'apply_insert_batch', 'replace_proxy', 'clean_backups',
+                            'del_backup', 'rest', 'view_backup', 'save_patch', 'save', 'restart', 'reload'))
+
+
+def route_label(path):
+    """Метка маршрута без переменных частей пути, чтобы число серий не росло."""
+    path = path.split('?')[0]
+    for prefix, label in (('/mihomo_panel/', '/mihomo_panel'), (ACE_URL + '/', '/static'),
+                          ('/api/jobs/', '/api/jobs'), ('/api/backups/', '/api/backups/item')):
+        if path.startswith(prefix): return label
+    return path if path in METRIC_ROUTES else 'other'
+
+
+def action_label(act):
+    """Метка POST-действия: неизвестные act сливаются в одну серию."""
+    if not act: return '/'
+    return f"act:{act}" if act in METRIC_ACTIONS else 'act:other'
+
+
+class CountingWriter:
+    """Обёртка над wfile, считающая отправленные байты."""
+
+    def __init__(s, raw):
+        s.raw = raw
+        s.count = 0
+
+    def write(s, b):
+        s.count += len(b)
+        return s.raw.write(b)
+
+    def __getattr__(s, name):
+        return getattr(s.raw, name)
+
+
+def iter_body(rfile, length, chunk=PROXY_CHUNK):
+    """Читает тело запроса кусками, не собирая его целиком в памяти."""
+    while length > 0:
+        buf = rfile.read(min(chunk, length))
+        if not buf: break
+        length -= len(buf)
+        yield buf
+
+
+def utf8_cut(data):
+    """Длина самого длинного префикса data, не разрывающего символ UTF-8."""
+    for k in range(1, min(4, len(data)) + 1):
+        b = data[-k]
+        if b < 0x80: return len(data)
+        if b >= 0xC0:  # первый байт символа: целый ли он
+            need = 2 if b < 0xE0 else 3 if b < 0xF0 else 4
+            return len(data) if need <= k else len(data) - k
+    return len(data)
+
+
+def copy_stream(resp, wfile, chunk=PROXY_CHUNK, chunked=False):
+    """Перекачивает ответ в сокет клиента по мере поступления данных.
+
+    read1() отдаёт то, что уже пришло (в т.ч. один chunk из chunked-ответа),
+    поэтому бесконечные /traffic и /logs не ждут заполнения буфера.
+    Блокирующая запись в сокет клиента даёт естественный backpressure.
+    chunked=True - заново кадрировать поток для клиента HTTP/1.1.
+    """
+    total = 0
+    while True:
+        buf = resp.read1(chunk)
+        if not buf: break
+        wfile.write(b'%x\r\n' % len(buf) + buf + b'\r\n' if chunked else buf)
+        total += len(buf)
+    if chunked: wfile.write(b'0\r\n\r\n')
+    return total
+
+
+class ControllerPool:
+    """Небольшой пул HTTP/1.1 соединений к контроллеру mihomo.
+
+    Соединение возвращается в пул только если ответ дочитан до конца и
+    сервер не просил закрыть его. Перед выдачей проверяется, что сокет
+    не закрыт удалённой стороной; простаивающие дольше POOL_IDLE закрываются.
+    """
+
+    def __init__(s, size=POOL_SIZE, idle=POOL_IDLE):
+        s.size = size
+        s.idle = idle
+        s.free = []  # [(host, port, conn, released_at)]
+        s.lock = threading.Lock()
+
+    @staticmethod
+    def alive(conn):
+        if conn.sock is None: return False
+        try:
+            # Читаемый простаивающий сокет = EOF/RST от контроллера или мусор
+            return not select.select([conn.sock], [], [], 0)[0]
+        except (OSError, ValueError):
+            return False
+
+    def evict(s, now):
+        keep = []
+        for item in s.free:
+            if now - item[3] > s.idle: item[2].close()
+            else: keep.append(item)
+        s.free = keep
+
+    def get(s, host, port):
+        """Возвращает (conn, reused)."""
+        with s.lock:
+            s.evict(time.monotonic())
+            while s.free:
+                h, p, conn, _ = s.free.pop()
+                if (h, p) == (host, port) and s.alive(conn):
+                    return conn, True
+                conn.close()
+        return http.client.HTTPConnection(host, port), False
+
+    def put(s, conn, resp):
+        if resp.length == 0 and not resp.isclosed():
+            resp.close()  # тело с Content-Length дочитано, read1() сам его не закрывает
+        if resp.will_close or not resp.isclosed() or conn.sock is None:
+            conn.close()
+            return
+        with s.lock:
+            s.evict(time.monotonic())
+            if len(s.free) >= s.size:
+                conn.close()
+                return
+            s.free.append((conn.host, conn.port, conn, time.monotonic()))
+
+    def close(s):
+        with s.lock:
+            for item in s.free: item[2].close()
+            s.free = []
+
+
+CTRL_POOL = ControllerPool()
+
+_static_cache = {}
+
+
+def static_asset(name):
+    """Файл Ace из ACE_DIR: исходник, gzip-версия и ETag (считаются один раз)."""
+    path = os.path.join(ACE_DIR, name)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (st.st_mtime_ns, st.st_size)
+    a = _static_cache.get(name)
+    if a and a['key'] == key: return a
+    with open(path, 'rb') as f:
+        raw = f.read()
+    gz = None
+    try:
+        # Предварительно сжатый файл кладёт mhstudio (gzip -9)
+        if os.path.getmtime(path + '.gz') >= st.st_mtime:
+            with open(path + '.gz', 'rb') as f:
+                gz = f.read()
+    except OSError:
+        pass
+    if gz is None: gz = gzip.compress(raw, 9)
+    a = {'key': key, 'raw': raw, 'gz': gz, 'etag': '"' + hashlib.sha1(raw).hexdigest()[:16] + '"'}
+    _static_cache[name] = a
+    return a
+
+# Адрес контроллера кэшируется до изменения config.yaml (mtime/inode/размер)
+# или цели симлинка профиля
+_ctrl_cache = {'key': None, 'info': None}
+_ctrl_lock = threading.Lock()
+
+
+def parse_controller(content):
+    info = {'host': '127.0.0.1', 'port': '', 'secret': ''}
+    # Ищет external-controller: "0.0.0.0:9090" или '127.0.0.1:9090' или просто :9090
+    m = re.search(r"^external-controller:\s*['\"]?([^'\"\s]*):(\d+)['\"]?", content, re.M)
+    if m:
+        host = m.group(1).strip('[]')
+        # Слушает на всех интерфейсах - ходим через loopback
+        if host and host not in ('0.0.0.0', '::', '*'):
+            info['host'] = host
+        info['port'] = m.group(2)
+    m = re.search(r"^secret:[ \t]*(.*)$", content, re.M)
+    # yaml_scalar снимает кавычки и отрезает " # комментарий" у значения без кавычек
+    if m: info['secret'] = yaml_scalar(m.group(1))
+    return info
+
+
+def controller_info():
+    """Возвращает {'host', 'port', 'secret', ...} активного профиля (с кэшем)."""
+    key = config_key()
+    if key is None:
+        return {'host': '127.0.0.1', 'port': '', 'secret': '', 'profile': None, 'loaded': None}
+    real = key[0]
+    with _ctrl_lock:
+        if _ctrl_cache['key'] == key:
+            return _ctrl_cache['info']
+        try:
+            with open(real, 'r', encoding='utf-8', errors='ignore') as f:
+                info = parse_controller(f.read())
+        except OSError:
+            info = parse_controller('')
+        info['profile'] = os.path.splitext(os.path.basename(real))[0]
+        info['loaded'] = time.time()
+        _ctrl_cache['key'], _ctrl_cache['info'] = key, info
+        return info
+
+
+# --- ЗАМЕРЫ ЗАДЕРЖКИ ---
+# Проверки идут через GET /proxies/<name>/delay контроллера mihomo
+DELAY_URL = "https://www.gstatic.com/generate_204"
+DELAY_TIMEOUT = 3000  # мс на одну проверку
+# Одновременных проверок на весь сервер: больше - нагрузка на роутер, меньше - долгий тест
+DELAY_WORKERS = int(os.environ.get("MHSTUDIO_DELAY_WORKERS", 16))
+DELAY_TTL = 300  # сколько секунд результат считается свежим
+DELAY_MAX = 1000  # имён за один запрос /api/delay, остальные пропускаются
+DELAY_SEM = threading.BoundedSemaphore(DELAY_WORKERS)
+_delay_cache = {}  # (host, port, name) -> {'delay', 'error', 'ts'}
+_delay_lock = threading.Lock()
+
+
+def proxy_delay(conn, ctrl, name, timeout=DELAY_TIMEOUT):
+    """Один замер по keep-alive соединению conn; возвращает {'delay', 'error', 'ts'}."""
+    path = f"/proxies/{urllib.parse.quote(name, safe='')}/delay?" + urllib.parse.urlencode({'timeout': timeout, 'url': DELAY_URL})
+    headers = {'Authorization': 'Bearer ' + ctrl['secret']} if ctrl['secret'] else {}
+    res = {'delay': 0, 'error': None, 'ts': time.time()}
+    try:
+        conn.request('GET', path, headers=headers)
+        resp = conn.getresponse()
+        status, body = resp.status, resp.read()
+    except (OSError, http.client.HTTPException) as e:
+        conn.close()  # следующий request() откроет соединение заново
+        res['error'] = str(e) or type(e).__name__
+        return res
+    try:
+        data = json.loads(body or b'{}')
+    except ValueError:
+        data = {}
+    if status == 200: res['delay'] = int(data.get('delay') or 0)
+    else: res['error'] = data.get('message') or f"HTTP {status}"
+    return res
+
+
+def delay_names(groups=None):
+    """Имена для проверки: все прокси профиля или участники выбранных групп."""
+    idx = config_index()
+    if not groups: return [p['name'] for p in idx.proxies()]
+    return list(dict.fromkeys(m['name'] for g in idx.groups() if g['name'] in groups for m in g['members']))
+
+
+def delay_batch(names, fresh=False, cached_only=False, start=None):
+    """Замеры для списка имён: свежие результаты из кэша, остальные - пулом потоков.
+
+    start() зовётся перед замерами, только если они нужны; False от него - отказ (None).
+    """
+    ctrl = controller_info()
+    if not ctrl['port']: return {'error': 'external-controller not found'}
+    key, now = (ctrl['host'], ctrl['port']), time.time()
+    out, todo = {}, []
+    with _delay_lock:
+        for k in [k for k, r in _delay_cache.items() if now - r['ts'] > DELAY_TTL]:
+            del _delay_cache[k]
+        for n in dict.fromkeys(names):
+            r = _delay_cache.get(key + (n,))
+            if r and not fresh: out[n] = r
+            elif not cached_only: todo.append(n)
+    if todo and start is not None and not start(): return None
+    it, it_lock = iter(todo), threading.Lock()
+
+    def worker():
+        conn = http.client.HTTPConnection(ctrl['host'], int(ctrl['port']), timeout=DELAY_TIMEOUT / 1000 + 2)
+        try:
+            while True:
+                with it_lock:
+                    n = next(it, None)
+                if n is None: return
+                with DELAY_SEM:
+                    r = proxy_delay(conn, ctrl, n)
+                with _delay_lock:
+                    _delay_cache[key + (n,)] = out[n] = r
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(min(DELAY_WORKERS, len(todo)))]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return {'results': out, 'tested': len(todo)}
+
+
 HTML_TEMPLATE = """<!DOCTYPE html>
 <html>
 <head>
 <meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no">
-<meta http-equiv="Cache-Control" content="no-cache, no-store, must-revalidate">
 <title>Mihomo Editor v1.1</title>
-<script src="https://cdnjs.cloudflare.com/ajax/libs/ace/1.32.7/ace.js"></script>
+<script src="__ACE_URL__/ace.js"></script>
 <style>
 :root {
     --bg: #1a1a1a; --bg-sec: #252526; --bg-ter: #2d2d2d;
@@ -510,11 +1914,12 @@ button:hover{filter:brightness(1.1)}
         <h2 style="margin:0;color:#4caf50" data-i18n="title">Mihomo Studio</h2>
         <span style="color:var(--txt-sec);font-size:12px">v1.1 Auto-Panel</span>
     </div>
-    <div id="last-load">Loaded: __TIME__</div>
+    <div id="last-load">Loaded:</div>
 </div>
 <div class="bar">
     <button onclick="save('save')" class="btn-s" data-i18n="save">💾 Сохранить</button>
     <button onclick="save('restart')" class="btn-r" data-i18n="restart">🚀 Рестарт</button>
+    <button onclick="save('reload')" class="btn-u" data-i18n="reload">⚡ Применить</button>
     <button onclick="openPanel()" class="btn-g" title="Открыть встроенную панель Mihomo" data-i18n="panel">🌐 Панель</button>
 
     <div style="display:flex; gap:5px; margin-left:auto;">
@@ -537,7 +1942,7 @@ button:hover{filter:brightness(1.1)}
         <div class="sec">
             <h3><span data-i18n="profiles">Профили</span></h3>
             <div class="prof-row">
-                <select id="prof-sel">__PROFILES__</select>
+                <select id="prof-sel"></select>
                 <button onclick="switchProf()" class="btn-s" style="padding:0; width:36px; justify-content:center;" title="Выбрать" data-i18n="select">✔</button>
                 <button onclick="downloadProf()" class="btn-g" style="padding:0; width:36px; justify-content:center;" title="Скачать" data-i18n="download">💾</button>
             </div>
@@ -562,7 +1967,13 @@ button:hover{filter:brightness(1.1)}
                 <input type="number" id="bk-lim" value="5" min="1" max="50">
                 <button onclick="cleanBackups()" class="btn-g" data-i18n="clean">Очистить</button>
             </div>
-            <div id="bk-list">__BACKUPS__</div>
+            <div class="bk-controls" style="margin-top:5px">
+                <select id="bk-prof" onchange="bkOffset=0;loadBackups()" style="flex:1;margin:0;height:28px"></select>
+                <button onclick="pageBackups(-1)" class="btn-u" style="margin-left:0">‹</button>
+                <span id="bk-pos"></span>
+                <button onclick="pageBackups(1)" class="btn-u" style="margin-left:0">›</button>
+            </div>
+            <div id="bk-list"></div>
         </div>
         <div class="sec" style="text-align: center; font-size: 11px; color: var(--txt-sec); padding: 10px 15px; border-bottom: none;">
             Copyright (c) 2025 Peter Lobanok
@@ -575,13 +1986,13 @@ button:hover{filter:brightness(1.1)}
 <div id="g-cnt" class="g-list"></div>
 <div style="display:flex;justify-content:flex-end;gap:10px;margin-top:15px;padding-top:10px;border-top:1px solid var(--bd)"><button onclick="applyVless()" class="btn-s" style="flex:1;justify-content:center" data-i18n="btn_add">Добавить</button><button onclick="closeM('m-grp')" class="btn-g" style="flex:1;justify-content:center" data-i18n="btn_cancel">Отмена</button></div></div></div>
 
-<div id="m-del" class="ovl"><div class="mod"><h3 data-i18n="modal_del_proxy">Удалить прокси</h3><select id="sel-del"></select><div style="display:flex;justify-content:flex-end;gap:10px;margin-top:15px"><button onclick="doDel()" class="btn-d" data-i18n="delete">Удалить</button><button onclick="closeM('m-del')" class="btn-g" data-i18n="btn_cancel">Отмена</button></div></div></div>
+<div id="m-del" class="ovl"><div class="mod"><h3 data-i18n="modal_del_proxy">Удалить прокси</h3><div style="display:flex;gap:8px;align-items:center"><select id="sel-del" style="flex:1;margin:0"></select><button onclick="testDelays(this)" class="btn-u" data-i18n-title="btn_test_delay" title="Проверить задержку" style="width:auto;margin:0">⏱</button></div><div style="display:flex;justify-content:flex-end;gap:10px;margin-top:15px"><button onclick="doDel()" class="btn-d" data-i18n="delete">Удалить</button><button onclick="closeM('m-del')" class="btn-g" data-i18n="btn_cancel">Отмена</button></div></div></div>
 <div id="m-con" class="ovl"><div class="mod"><h3 data-i18n="modal_console">Консоль</h3><div id="cons">...</div><div style="display:flex;justify-content:flex-end;gap:10px;margin-top:15px"><button onclick="location.reload()" class="btn-s" data-i18n="btn_update">Обновить</button><button onclick="closeM('m-con')" class="btn-g" data-i18n="btn_close">Закрыть</button></div></div></div>
 
 <div id="m-ren" class="ovl"><div class="mod">
     <h3 data-i18n="modal_ren_proxy">Переименовать прокси</h3>
     <p style="margin-top:0;font-size:13px;color:var(--txt-sec)" data-i18n="lbl_sel_ren">Выберите прокси для переименования:</p>
-    <select id="sel-ren-proxy"></select>
+    <div style="display:flex;gap:8px;align-items:center"><select id="sel-ren-proxy" style="flex:1;margin:0"></select><button onclick="testDelays(this)" class="btn-u" data-i18n-title="btn_test_delay" title="Проверить задержку" style="width:auto;margin:0">⏱</button></div>
     <p style="margin-top:15px;font-size:13px;color:var(--txt-sec)" data-i18n="lbl_new_name">Новое имя:</p>
     <input id="inp-ren-newname" placeholder="Введите новое имя" data-i18n-ph="ph_new_name">
     <div style="display:flex;justify-content:flex-end;gap:10px;margin-top:20px">
@@ -614,13 +2025,14 @@ button:hover{filter:brightness(1.1)}
 
     <div id="edit-proxy-container" style="display:none; margin-bottom:10px;">
         <label style="font-size:12px; margin-bottom:5px; color:var(--txt-sec)" data-i18n="lbl_select_edit">Выберите прокси для изменения:</label>
-        <select id="edit-proxy-sel"></select>
+        <div style="display:flex;gap:8px;align-items:center"><select id="edit-proxy-sel" style="flex:1;margin:0"></select><button onclick="testDelays(this)" class="btn-u" data-i18n-title="btn_test_delay" title="Проверить задержку" style="width:auto;margin:0">⏱</button></div>
         <div style="font-size:11px; color:var(--btn-u); margin-top:5px;" data-i18n="warn_edit">⚠️ Данные этого прокси будут полностью заменены новыми!</div>
     </div>
 
     <div class="modal-tabs">
         <button class="active" onclick="switchTab(event, 'vlessTab')" data-i18n="tab_vless">VLESS</button>
         <button onclick="switchTab(event, 'wgTab')" data-i18n="tab_wg">WireGuard|AmneziaWG</button>
+        <button id="tab-sub-btn" onclick="switchTab(event, 'subTab')" data-i18n="tab_sub">Подписка</button>
     </div>
 
     <div id="vlessTab" class="tab-content active">
@@ -644,25 +2056,38 @@ button:hover{filter:brightness(1.1)}
             <input id="wgProxyName" placeholder="Автоматически из Endpoint" data-i18n-ph="ph_auto_wg" style="margin-bottom:10px;">
         </div>
 
+        <div id="wg-archive-block">
+            <input type="file" id="wgArchive" accept=".zip,.tar,.tgz,.gz,.bz2,.xz" style="display:none" onchange="uploadWgArchive(this)">
+            <button onclick="document.getElementById('wgArchive').click()" class="btn-u" style="width:100%; justify-content:center; margin-bottom:10px;" data-i18n="btn_load_archive">📦 Загрузить архив .conf (zip/tar.gz)</button>
+        </div>
         <input type="file" id="wgFile" accept=".conf" style="display:none" onchange="loadWgFile(this)">
         <button onclick="document.getElementById('wgFile').click()" class="btn-u" style="width:100%; justify-content:center; margin-bottom:10px;" data-i18n="btn_load_file">📂 Или загрузить .conf файл</button>
         <button onclick="addWireguard()" class="btn-s" style="width:100%; justify-content:center;" data-i18n="btn_save">Сохранить</button>
     </div>
+
+    <div id="subTab" class="tab-content">
+        <label style="font-size:12px; margin-bottom:5px; color:var(--txt-sec)" data-i18n="lbl_sub">Подписка (ссылки по одной в строке или base64):</label>
+        <textarea id="subText" rows="8" placeholder="vless://...&#10;vless://..." style="width:100%; margin-bottom:10px;"></textarea>
+        <input type="file" id="subFile" style="display:none" onchange="loadSubFile(this)">
+        <button onclick="document.getElementById('subFile').click()" class="btn-u" style="width:100%; justify-content:center; margin-bottom:10px;" data-i18n="btn_load_file">📂 Загрузить файл</button>
+        <button onclick="parseSub()" class="btn-s" style="width:100%; justify-content:center;" data-i18n="btn_add">Добавить</button>
+    </div>
 </div></div>
 
 <div id="m-view-bk" class="ovl"><div class="mod">
     <h3 data-i18n="modal_view_bk">Просмотр бэкапа</h3>
     <pre id="bk-content" style="flex-grow:1; overflow-y:auto; min-height: 200px; max-height:60vh;"></pre>
     <div style="display:flex;justify-content:flex-end;gap:10px;margin-top:15px;padding-top:10px;border-top:1px solid var(--bd)">
+        <button id="bk-diff-btn" class="btn-u" data-i18n="btn_diff_current">Разница с текущим</button>
         <button id="bk-restore-btn" class="btn-r" data-i18n="btn_restore">Восстановить</button>
         <button onclick="closeM('m-view-bk')" class="btn-g" data-i18n="btn_close">Закрыть</button>
     </div>
 </div></div>
 
 <script>
+ace.config.set('basePath', '__ACE_URL__');
 var ed=ace.edit("ed");ed.setTheme("ace/theme/monokai");ed.session.setMode("ace/mode/yaml");ed.setOptions({fontSize:14,tabSize:2,useSoftTabs:true});
 var pData=null, GRP_KEY="mihomo_grp_sel", LIM_KEY="mihomo_bk_lim", THM_KEY="mihomo_theme", LANG_KEY="mihomo_lang";
-var initialConfig = __JSON_CONTENT__;
 var isEditMode = false;
 var currLang = 'ru';
 
@@ -670,6 +2095,7 @@ const TR = {
     ru: {
         title: "Mihomo Studio",
         save: "💾 Сохранить",
+        reload: "⚡ Применить",
         restart: "🚀 Рестарт",
         panel: "🌐 Панель",
         profiles: "Профили",
@@ -688,11 +2114,21 @@ const TR = {
         theme_light: "☀️ Светлая",
         theme_midnight: "🌃 Полночь",
         theme_cyber: "👾 Кибер",
+        toast_reloaded: "⚡ Применено без рестарта за {0} мс",
+        reload_fallback: "⏳ Нужен полный рестарт ({0})...",
         toast_saved: "✅ Успешно сохранено",
+        all_profiles: "Все профили",
+        no_backups: "Нет бэкапов",
+        btn_diff_current: "Разница с текущим",
+        no_changes: "Нет изменений",
+        btn_test_delay: "Проверить задержку",
+        bk_view: "Просмотр",
+        bk_del: "Удалить",
         toast_cleaned: "🧹 Очищено",
         toast_deleted: "🗑 Удалено",
         toast_restored: "♻️ Восстановлено",
         toast_added: "✅ Добавлено",
+        toast_added_n: "✅ Добавлено {0} из {1}",
         toast_renamed: "✏️ Прокси переименован",
         toast_updated: "✏️ Данные прокси обновлены",
         confirm_switch: "Переключиться на профиль {0}?",
@@ -700,6 +2136,7 @@ const TR = {
         confirm_del_bk: "Удалить бэкап {0}?",
         confirm_clean: "Оставить только {0} последних бэкапов?",
         confirm_restore: "Восстановить {0}? Текущий конфиг будет перезаписан.",
+        confirm_overwrite: "Конфиг был изменён в другой вкладке. Перезаписать его вашей версией?",
         confirm_del_proxy: "Удалить?",
         confirm_replace: "Заменить данные прокси '{0}'?",
         prompt_enter_name: "Введите имя!",
@@ -720,6 +2157,10 @@ const TR = {
         btn_update: "Обновить",
         tab_vless: "VLESS",
         tab_wg: "WireGuard|AmneziaWG",
+        btn_load_archive: "📦 Загрузить архив .conf (zip/tar.gz)",
+        tab_sub: "Подписка",
+        lbl_sub: "Подписка (ссылки по одной в строке или base64):",
+        error_sub_empty: "В подписке не найдено поддерживаемых ссылок",
         lbl_select_edit: "Выберите прокси для изменения:",
         warn_edit: "⚠️ Данные этого прокси будут полностью заменены новыми!",
         modal_new_prof: "Новый профиль",
@@ -741,6 +2182,7 @@ const TR = {
         btn_rename: "Переименовать",
         modal_console: "Консоль",
         modal_view_bk: "Просмотр бэкапа",
+        job_done: "⏱ Завершено за {0} с",
         log_loading: "⏳ Выполнение xkeen -restart...",
         last_load: "Загружено:",
         last_saved: "Сохранено:"
@@ -748,6 +2190,7 @@ const TR = {
     uk: {
         title: "Mihomo Studio",
         save: "💾 Зберегти",
+        reload: "⚡ Застосувати",
         restart: "🚀 Рестарт",
         panel: "🌐 Панель",
         profiles: "Профілі",
@@ -766,11 +2209,21 @@ const TR = {
         theme_light: "☀️ Світла",
         theme_midnight: "🌃 Північ",
         theme_cyber: "👾 Кібер",
+        toast_reloaded: "⚡ Застосовано без рестарту за {0} мс",
+        reload_fallback: "⏳ Потрібен повний рестарт ({0})...",
         toast_saved: "✅ Успішно збережено",
+        all_profiles: "Усі профілі",
+        no_backups: "Немає бекапів",
+        btn_diff_current: "Різниця з поточним",
+        no_changes: "Немає змін",
+        btn_test_delay: "Перевірити затримку",
+        bk_view: "Перегляд",
+        bk_del: "Видалити",
         toast_cleaned: "🧹 Очищено",
         toast_deleted: "🗑 Видалено",
         toast_restored: "♻️ Відновлено",
         toast_added: "✅ Додано",
+        toast_added_n: "✅ Додано {0} з {1}",
         toast_renamed: "✏️ Проксі перейменовано",
         toast_updated: "✏️ Дані проксі оновлено",
         confirm_switch: "Переключитися на профіль {0}?",
@@ -778,6 +2231,7 @@ const TR = {
         confirm_del_bk: "Видалити бекап {0}?",
         confirm_clean: "Залишити тільки {0} останніх бекапів?",
         confirm_restore: "Відновити {0}? Поточний конфіг буде перезаписано.",
+        confirm_overwrite: "Конфіг було змінено в іншій вкладці. Перезаписати його вашою версією?",
         confirm_del_proxy: "Видалити?",
         confirm_replace: "Замінити дані проксі '{0}'?",
         prompt_enter_name: "Введіть ім'я!",
@@ -798,6 +2252,10 @@ const TR = {
         btn_update: "Оновити",
         tab_vless: "VLESS",
         tab_wg: "WireGuard|AmneziaWG",
+        btn_load_archive: "📦 Завантажити архів .conf (zip/tar.gz)",
+        tab_sub: "Підписка",
+        lbl_sub: "Підписка (посилання по одному в рядку або base64):",
+        error_sub_empty: "У підписці не знайдено підтримуваних посилань",
         lbl_select_edit: "Виберіть проксі для зміни:",
         warn_edit: "⚠️ Дані цього проксі будуть повністю замінені новими!",
         modal_new_prof: "Новий профіль",
@@ -819,6 +2277,7 @@ const TR = {
         btn_rename: "Перейменувати",
         modal_console: "Консоль",
         modal_view_bk: "Перегляд бекапу",
+        job_done: "⏱ Завершено за {0} с",
         log_loading: "⏳ Виконання xkeen -restart...",
         last_load: "Завантажено:",
         last_saved: "Збережено:"
@@ -826,6 +2285,7 @@ const TR = {
     en: {
         title: "Mihomo Studio",
         save: "💾 Save",
+        reload: "⚡ Hot reload",
         restart: "🚀 Restart",
         panel: "🌐 Panel",
         profiles: "Profiles",
@@ -844,11 +2304,21 @@ const TR = {
         theme_light: "☀️ Light",
         theme_midnight: "🌃 Midnight",
         theme_cyber: "👾 Cyber",
+        toast_reloaded: "⚡ Applied without restart in {0} ms",
+        reload_fallback: "⏳ Full restart required ({0})...",
         toast_saved: "✅ Saved successfully",
+        all_profiles: "All profiles",
+        no_backups: "No backups",
+        btn_diff_current: "Diff with current",
+        no_changes: "No changes",
+        btn_test_delay: "Test latency",
+        bk_view: "View",
+        bk_del: "Delete",
         toast_cleaned: "🧹 Cleaned",
         toast_deleted: "🗑 Deleted",
         toast_restored: "♻️ Restored",
         toast_added: "✅ Added",
+        toast_added_n: "✅ Added {0} of {1}",
         toast_renamed: "✏️ Proxy renamed",
         toast_updated: "✏️ Proxy data updated",
         confirm_switch: "Switch to profile {0}?",
@@ -856,6 +2326,7 @@ const TR = {
         confirm_del_bk: "Delete backup {0}?",
         confirm_clean: "Keep only the last {0} backups?",
         confirm_restore: "Restore {0}? Current config will be overwritten.",
+        confirm_overwrite: "The config was changed in another tab. Overwrite it with your version?",
         confirm_del_proxy: "Delete?",
         confirm_replace: "Replace data for proxy '{0}'?",
         prompt_enter_name: "Enter name!",
@@ -876,6 +2347,10 @@ const TR = {
         btn_update: "Update",
         tab_vless: "VLESS",
         tab_wg: "WireGuard|AmneziaWG",
+        btn_load_archive: "📦 Upload .conf archive (zip/tar.gz)",
+        tab_sub: "Subscription",
+        lbl_sub: "Subscription (one link per line or base64):",
+        error_sub_empty: "No supported links found in the subscription",
         lbl_select_edit: "Select proxy to replace:",
         warn_edit: "⚠️ This proxy's data will be fully replaced!",
         modal_new_prof: "New Profile",
@@ -897,6 +2372,7 @@ const TR = {
         btn_rename: "Rename",
         modal_console: "Console",
         modal_view_bk: "View Backup",
+        job_done: "⏱ Finished in {0} s",
         log_loading: "⏳ Running xkeen -restart...",
         last_load: "Loaded:",
         last_saved: "Saved:"
@@ -922,6 +2398,10 @@ function setLang(l) {
         let k = e.getAttribute('data-i18n-ph');
         if(TR[l][k]) e.placeholder = TR[l][k];
     });
+    document.querySelectorAll('[data-i18n-title]').forEach(e => {
+        let k = e.getAttribute('data-i18n-title');
+        if(TR[l][k]) e.title = TR[l][k];
+    });
 
     // Update dynamic parts
     if(isEditMode) document.getElementById('proxyModalTitle').innerText = TR[l].modal_edit_proxy;
@@ -933,7 +2413,57 @@ function openPanel() {
     var url = window.location.protocol + "//" + window.location.host + "/mihomo_panel/ui/";
     window.open(url, '_blank');
 }
-ed.setValue(initialConfig); ed.clearSelection();
+// Страница статична и кэшируется; данные приходят из /api/* (ответ 304, если не менялись)
+function loadJSON(url) { return fetch(url).then(r => r.json()); }
+function loadConfig() {
+    return loadJSON('/api/config').then(d => {
+        ed.setValue(d.content); ed.clearSelection();
+        baseText = d.content; baseVer = d.version;
+        document.getElementById('last-load').innerText = t('last_load') + " " + new Date().toLocaleTimeString();
+    });
+}
+function loadProfiles() {
+    return loadJSON('/api/profiles').then(d => {
+        var s = document.getElementById('prof-sel'); s.innerHTML = '';
+        d.profiles.forEach(n => {
+            var o = document.createElement('option'); o.value = n; o.text = n;
+            if (n === d.current) o.selected = true;
+            s.add(o);
+        });
+    });
+}
+// Список бэкапов постранично; сервер отдаёт его из журнала в памяти
+var bkOffset = 0, bkLimit = 10, bkTotal = 0;
+function loadBackups() {
+    var sel = document.getElementById('bk-prof');
+    var q = new URLSearchParams({offset: bkOffset, limit: bkLimit, profile: sel.value});
+    return loadJSON('/api/backups?' + q).then(d => {
+        if (d.total && d.offset >= d.total) { bkOffset = Math.max(0, d.total - bkLimit); return loadBackups(); }
+        bkTotal = d.total;
+        var cur = sel.value;
+        sel.innerHTML = '<option value="">' + t('all_profiles') + '</option>' + d.profiles.map(n => '<option>' + n + '</option>').join('');
+        sel.value = d.profiles.indexOf(cur) >= 0 ? cur : '';
+        document.getElementById('bk-pos').innerText = d.total ? (d.offset + 1) + '–' + (d.offset + d.items.length) + ' / ' + d.total : '0';
+        var b = d.items.map(e => {
+            var dt = new Date(e.ts * 1000), pad = x => String(x).padStart(2, '0');
+            var tm = pad(dt.getDate()) + '.' + pad(dt.getMonth() + 1) + ' ' + pad(dt.getHours()) + ':' + pad(dt.getMinutes());
+            return `<div class="bk-item">
+                    <div><b>${e.name}</b><span style="font-size:10px;color:var(--txt-sec)">${tm} · ${(e.size / 1024).toFixed(1)} KB</span></div>
+                    <div class="bk-btns">
+                        <button onclick="viewBackup('${e.name}')" class="btn-u" title="${t('bk_view')}">👁️</button>
+                        <button onclick="restoreBackup('${e.name}')" class="btn-g" title="${t('btn_restore')}">↺</button>
+                        <button onclick="delBackup('${e.name}')" class="btn-d" title="${t('bk_del')}">✕</button>
+                    </div>
+                   </div>`;
+        }).join('');
+        document.getElementById('bk-list').innerHTML = b || '<div style="color:var(--txt-sec);font-size:12px;text-align:center;padding:10px">' + t('no_backups') + '</div>';
+    });
+}
+function pageBackups(dir) {
+    var next = bkOffset + dir * bkLimit;
+    if (next < 0 || (dir > 0 && next >= bkTotal)) return;
+    bkOffset = next; loadBackups();
+}
 
 document.getElementById('vlessLink').addEventListener('input', function() {
     if(isEditMode) return; 
@@ -1060,37 +2590,89 @@ setTheme(savedTheme);
 var savedLang = localStorage.getItem(LANG_KEY) || 'ru';
 setLang(savedLang);
 
+loadConfig(); loadProfiles(); loadBackups();
+
 var bkInp = document.getElementById('bk-lim');
 if(localStorage.getItem(LIM_KEY)) bkInp.value = localStorage.getItem(LIM_KEY);
 bkInp.addEventListener('change', function(){ localStorage.setItem(LIM_KEY, this.value); });
 
-function save(mode){
+// Последняя синхронизированная с сервером версия буфера: сохраняем только разницу
+var baseText = null, baseVer = null;
+
+function lineDiff(a, b) {
+    var x = a.split('\\n'), y = b.split('\\n');
+    var p = 0, n = Math.min(x.length, y.length);
+    while (p < n && x[p] === y[p]) p++;
+    var ex = x.length, ey = y.length;
+    while (ex > p && ey > p && x[ex - 1] === y[ey - 1]) { ex--; ey--; }
+    return [{start: p, del: ex - p, lines: y.slice(p, ey)}];
+}
+
+function save(mode, full){
     var c=ed.getValue();
-    var p=new URLSearchParams(); p.append('act', mode); p.append('content', c);
+    var p=new URLSearchParams();
+    if(baseVer && !full) {
+        p.append('act', 'save_patch'); p.append('mode', mode); p.append('base', baseVer);
+        p.append('edits', JSON.stringify(lineDiff(baseText, c)));
+    } else {
+        p.append('act', mode); p.append('content', c);
+    }
     if(mode==='restart') {
         document.getElementById('m-con').style.display='flex'; 
         document.getElementById('cons').innerHTML='<div style="padding:20px;text-align:center">' + t('log_loading') + '</div>';
     }
     fetch('/',{method:'POST',body:p}).then(r=>r.json()).then(d=>{
-        if(mode==='save'){
-            showToast(t('toast_saved'));
+        if(d.error === 'stale') {
+            closeM('m-con');
+            if(confirm(t('confirm_overwrite'))) save(mode, true);
+            return;
+        }
+        if(d.error) return alert(d.error);
+        if(d.version) { baseText = c; baseVer = d.version; }
+        if(mode==='reload' && d.reloaded){
+            showToast(t('toast_reloaded', d.ms));
             document.getElementById('last-load').innerText = t('last_saved') + " " + d.time;
-            if(d.backups) document.getElementById('bk-list').innerHTML = d.backups;
+            bkOffset = 0; loadBackups();
+        } else if(mode==='reload'){
+            // Изменения требуют полного рестарта
+            document.getElementById('m-con').style.display='flex';
+            document.getElementById('cons').innerHTML='<div style="padding:20px;text-align:center">' + t('reload_fallback', d.reason) + '</div>';
+            followJob(d.job);
+        } else if(mode==='save'){
+            showToast(d.unchanged ? t('no_changes') : t('toast_saved'));
+            document.getElementById('last-load').innerText = t('last_saved') + " " + d.time;
+            bkOffset = 0; loadBackups();
         } else {
-            var consoleDiv = document.getElementById('cons');
-            consoleDiv.innerHTML = fmtLog(d.log);
-            consoleDiv.scrollTop = consoleDiv.scrollHeight;
+            followJob(d.job);
         }
     }).catch(e=>alert("Error: "+e));
 }
 
+// Лог рестарта приходит по мере выполнения (Server-Sent Events)
+function followJob(job) {
+    var consoleDiv = document.getElementById('cons');
+    var raw = '';
+    var es = new EventSource('/api/jobs/' + job.id + '/log');
+    es.addEventListener('log', function(e) {
+        raw += JSON.parse(e.data).text;
+        consoleDiv.innerHTML = fmtLog(raw);
+        consoleDiv.scrollTop = consoleDiv.scrollHeight;
+    });
+    es.addEventListener('done', function(e) {
+        es.close();
+        var j = JSON.parse(e.data);
+        consoleDiv.innerHTML = fmtLog(raw) + '<div class="log-line"><span class="' + (j.state === 'done' ? 'log-info' : 'log-err') + '">' + t('job_done', j.duration) + '</span></div>';
+        consoleDiv.scrollTop = consoleDiv.scrollHeight;
+    });
+}
+
 function cleanBackups(){
     var lim = document.getElementById('bk-lim').value;
     if(!confirm(t('confirm_clean', lim))) return;
     var p=new URLSearchParams(); p.append('act', 'clean_backups'); p.append('limit', lim);
     fetch('/',{method:'POST',body:p}).then(r=>r.json()).then(d=>{
         showToast(t('toast_cleaned'));
-        if(d.backups) document.getElementById('bk-list').innerHTML = d.backups;
+        loadBackups();
     });
 }
 
@@ -1099,7 +2681,7 @@ function delBackup(fname){
     var p=new URLSearchParams(); p.append('act', 'del_backup'); p.append('f', fname);
     fetch('/',{method:'POST',body:p}).then(r=>r.json()).then(d=>{
         showToast(t('toast_deleted'));
-        if(d.backups) document.getElementById('bk-list').innerHTML = d.backups;
+        loadBackups();
     });
 }
 
@@ -1113,11 +2695,19 @@ function viewBackup(fname) {
         } else {
             document.getElementById('bk-content').textContent = d.content;
             document.getElementById('bk-restore-btn').onclick = function() { restoreBackup(fname) };
+            document.getElementById('bk-diff-btn').onclick = function() { diffBackup(fname, 'current') };
             document.getElementById('m-view-bk').style.display = 'flex';
         }
     });
 }
 
+// Разница версии с другой версией или с текущим конфигом ('current')
+function diffBackup(fname, other) {
+    fetch('/api/backups/' + encodeURIComponent(fname) + '?diff=' + encodeURIComponent(other)).then(r => r.text()).then(txt => {
+        document.getElementById('bk-content').textContent = txt || t('no_changes');
+    });
+}
+
 function restoreBackup(fname){
     if(!confirm(t('confirm_restore', fname))) return;
     var p=new URLSearchParams(); p.append('act', 'rest'); p.append('f', fname);
@@ -1146,6 +2736,8 @@ function openAddProxyModal() {
     document.querySelector('[data-i18n="tab_vless"]').innerText = t('tab_vless');
     document.querySelector('[data-i18n="tab_wg"]').innerText = t('tab_wg');
     document.getElementById('edit-proxy-container').style.display = 'none';
+    document.getElementById('tab-sub-btn').style.display = '';
+    document.getElementById('wg-archive-block').style.display = 'block';
     document.getElementById('vless-name-block').style.display = 'block';
     document.getElementById('wg-name-block').style.display = 'block';
 
@@ -1164,6 +2756,9 @@ function openEditProxyModal() {
     document.querySelector('[data-i18n="tab_vless"]').innerText = t('tab_vless');
     document.querySelector('[data-i18n="tab_wg"]').innerText = t('tab_wg');
     document.getElementById('edit-proxy-container').style.display = 'block';
+    document.getElementById('tab-sub-btn').style.display = 'none';
+    document.getElementById('wg-archive-block').style.display = 'none';
+    if (document.getElementById('subTab').classList.contains('active')) document.querySelector('.modal-tabs button').click();
     document.getElementById('vless-name-block').style.display = 'none';
     document.getElementById('wg-name-block').style.display = 'none';
 
@@ -1178,11 +2773,8 @@ function openEditProxyModal() {
         sel.disabled = true;
     } else {
         sel.disabled = false;
-        prs.forEach(p => {
-            var o = document.createElement('option');
-            o.text = p;
-            sel.add(o);
-        });
+        fillProxySel(sel, prs);
+        loadDelays(false);
     }
 
     // Clear inputs
@@ -1219,6 +2811,21 @@ function loadWgFile(input) {
     input.value = '';
 }
 
+function uploadWgArchive(input) {
+    var f = input.files[0];
+    if (!f) return;
+    input.value = '';
+    fetch('/api/wg_archive', { method: 'POST', body: f })
+        .then(r => r.json())
+        .then(d => {
+            if (d.error) return alert(d.error);
+            if (!d.ok) return alert(d.items.map(x => x.file + ': ' + x.error).join('\\n') || t('error_empty_wg'));
+            pData = d.items.map(x => x.error ? {name: x.file, error: x.error} : x);
+            closeM('addProxyModal');
+            showG();
+        });
+}
+
 function addWireguard() {
     var conf = document.getElementById('wgConfig').value;
     var name = ''; 
@@ -1254,6 +2861,30 @@ function addWireguard() {
         });
 }
 
+function loadSubFile(input) {
+    var f = input.files[0];
+    if (!f) return;
+    var r = new FileReader();
+    r.onload = function(e) { document.getElementById('subText').value = e.target.result; };
+    r.readAsText(f);
+    input.value = '';
+}
+
+function parseSub() {
+    var txt = document.getElementById('subText').value;
+    if (!txt.trim()) return;
+    fetch('/api/subscription', { method: 'POST', body: txt })
+        .then(r => r.json())
+        .then(d => {
+            if (d.error) return alert(d.error);
+            if (!d.ok) return alert(t('error_sub_empty'));
+            // Ошибочные строки тоже уходят в пакет - попадут в отчёт импорта
+            pData = d.items.map(x => x.error ? {name: x.link, error: 'line ' + x.line + ': ' + x.error} : x);
+            closeM('addProxyModal');
+            showG();
+        });
+}
+
 function parseVless(){
     var link = document.getElementById('vlessLink').value;
     var name = '';
@@ -1328,14 +2959,53 @@ function applyVless(){
     closeM('m-grp'); var txt=ed.getValue(); var sels=[];
     document.querySelectorAll('#g-cnt input:checked').forEach(c=>sels.push(c.value));
     localStorage.setItem(GRP_KEY, JSON.stringify(sels));
-    var p=new URLSearchParams(); p.append('act','apply_insert'); p.append('content',txt); p.append('proxy_name',pData.name); p.append('proxy_yaml',pData.yaml); p.append('targets',JSON.stringify(sels));
+    var p=new URLSearchParams(); p.append('content',txt); p.append('targets',JSON.stringify(sels));
+    if(Array.isArray(pData)) {
+        // Пакетный импорт: все прокси и группы за один запрос
+        p.append('act','apply_insert_batch'); p.append('items',JSON.stringify(pData));
+        fetch('/',{method:'POST',body:p}).then(r=>r.json()).then(d=>{
+            if(d.error) return alert(d.error);
+            ed.setValue(d.new_content); ed.clearSelection();
+            var ok = d.report.filter(x=>x.status==='ok').length;
+            var bad = d.report.filter(x=>x.status!=='ok').map(x=>x.name+': '+(x.error||x.status));
+            showToast(t('toast_added_n', ok, d.report.length));
+            if(bad.length) alert(bad.join('\\n'));
+        });
+        return;
+    }
+    p.append('act','apply_insert'); p.append('proxy_name',pData.name); p.append('proxy_yaml',pData.yaml);
     fetch('/',{method:'POST',body:p}).then(r=>r.json()).then(d=>{if(d.error)alert(d.error);else{ed.setValue(d.new_content);ed.clearSelection();showToast(t('toast_added'))}});
 }
+// Задержки прокси: при открытии выбора показывается кэш сервера, по кнопке ⏱ - новый тест
+var delays = {};
+function delayLabel(n) {
+    var r = delays[n];
+    return !r ? n : n + (r.error ? '  — ✕' : '  — ' + r.delay + ' ms');
+}
+function fillProxySel(sel, prs) {
+    sel.innerHTML = '';
+    prs.forEach(p => { var o = document.createElement('option'); o.value = p; o.text = delayLabel(p); sel.add(o); });
+}
+function loadDelays(fresh) {
+    return loadJSON('/api/delay?' + (fresh ? 'fresh=1' : 'cached=1')).then(d => {
+        if (d.error) { if (fresh) alert(d.error); return; }
+        Object.assign(delays, d.results);
+        ['sel-del', 'sel-ren-proxy', 'edit-proxy-sel'].forEach(id => {
+            for (var o of document.getElementById(id).options) if (o.value in delays) o.text = delayLabel(o.value);
+        });
+    });
+}
+function testDelays(btn) {
+    btn.disabled = true;
+    loadDelays(true).finally(() => { btn.disabled = false; });
+}
+
 function showDel(){
     var prs = getProxiesList();
     var s=document.getElementById('sel-del');s.innerHTML='';
-    prs.forEach(p=>{var o=document.createElement('option');o.text=p;s.add(o)});
+    fillProxySel(s, prs);
     document.getElementById('m-del').style.display='flex';
+    loadDelays(false);
 }
 function doDel(){
     var nm=document.getElementById('sel-del').value;if(!nm)return;if(!confirm(t('confirm_del_proxy')))return;closeM('m-del');
@@ -1376,14 +3046,10 @@ function doDel(){
 function showRename() {
     var prs = getProxiesList();
     var s = document.getElementById('sel-ren-proxy');
-    s.innerHTML = '';
-    prs.forEach(p => {
-        var o = document.createElement('option');
-        o.text = p;
-        s.add(o)
-    });
+    fillProxySel(s, prs);
     document.getElementById('inp-ren-newname').value = '';
     document.getElementById('m-ren').style.display = 'flex';
+    loadDelays(false);
 }
 
 function doRename() {
@@ -1419,136 +3085,566 @@ function doRename() {
         })
         .catch(e => alert("Сетевая ошибка: " + e));
 }
-</script></body></html>"""
+</script></body></html>""".replace('__ACE_URL__', ACE_URL)
+
+# Оболочка страницы не зависит от конфига - собирается один раз
+SHELL_HTML = HTML_TEMPLATE.encode('utf-8')
+SHELL_ETAG = '"' + hashlib.sha1(SHELL_HTML).hexdigest()[:16] + '"'
+SHELL_GZ = gzip.compress(SHELL_HTML, 9)
+
+
+def compress(body, enc, level=GZIP_LEVEL):
+    if enc == 'gzip': return gzip.compress(body, level)
+    return zlib.compress(body, level)  # HTTP "deflate" = zlib-поток
+
+
+def accept_encoding(header):
+    """Выбирает gzip/deflate из Accept-Encoding (с учётом q=0)."""
+    ok = set()
+    for part in (header or '').lower().split(','):
+        name, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q=') and q[2:].strip() in ('0', '0.0', '0.00', '0.000'): continue
+        ok.add(name.strip())
+    for enc in ('gzip', 'deflate'):
+        if enc in ok: return enc
+    return None
+
+
+def file_etag(*paths):
+    """ETag по метаданным файлов/каталогов - без чтения содержимого."""
+    parts = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            parts.append(f"{os.path.realpath(path)}:{st.st_ino}:{st.st_mtime_ns}:{st.st_size}")
+        except OSError:
+            parts.append(path + ":-")
+    return '"' + hashlib.sha1("|".join(parts).encode('utf-8')).hexdigest()[:16] + '"'
 
 
 class H(http.server.SimpleHTTPRequestHandler):
-    def end_headers(s):
-        s.send_header('Cache-Control', 'no-store, no-cache, must-revalidate');
-        s.send_header('Pragma',
-                      'no-cache');
-        s.send_header(
-            'Expires', '0');
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_IDLE
+    # Заголовки и тело уходят разными send(): с Nagle на keep-alive тело ждёт delayed ACK (~40 мс)
+    disable_nagle_algorithm = True
+    # None - динамический ответ (no-store), '' - не трогать заголовки, иначе своё значение
+    cache_ctl = None
+    prof_lock = threading.Lock()  # один профилируемый запрос за раз
+
+    def setup(s):
+        super().setup()
+        s.served, s.slot = 0, None
+        s.wfile = CountingWriter(s.wfile)
+
+    def parse_request(s):
+        # Отсчёт с момента получения строки запроса, а не с начала ожидания keep-alive
+        s.t_start, s.route, s.status, s.headers = time.monotonic(), None, None, None
+        s.t_mark, s.timing, s.profiler, s.prof_path = s.t_start, {}, None, None
+        s.wfile.count = 0
+        if not super().parse_request(): return False
+        # Обработчик занимается на время запроса: простой keep-alive его не держит
+        if not s.server.slots.acquire(timeout=WORKER_WAIT):
+            METRICS.inc('mhstudio_rejected_total', (('limit', 'workers'),))
+            s.send_error(503, "Server busy")
+            return False
+        s.slot = s.server.slots
+        u = urllib.parse.urlsplit(s.path)
+        q = urllib.parse.parse_qsl(u.query, keep_blank_values=True)
+        flag = any(k == 'cprofile' for k, _ in q)
+        if flag:
+            # Флаг убирается из пути, чтобы маршрутизация не заметила его
+            s.path = urllib.parse.urlunsplit(('', '', u.path, urllib.parse.urlencode([x for x in q if x[0] != 'cprofile']), ''))
+        # Активным может быть только один профилировщик (Python 3.12+) - занят, значит без профиля
+        if (PROFILE_ALL or flag) and s.prof_lock.acquire(blocking=False):
+            try:
+                s.profiler = cProfile.Profile()
+                s.profiler.enable()
+            except ValueError:
+                s.profiler = None
+                s.prof_lock.release()
+                return True
+            name = re.sub(r'[^A-Za-z0-9_.-]+', '_', u.path.strip('/')) or 'root'
+            s.prof_path = f"{PROFILE_DIR}/mhstudio_{datetime.now():%Y%m%d_%H%M%S}_{s.command}_{name}_{os.urandom(2).hex()}.prof"
+        return True
+
+    def mark(s, phase):
+        """Относит время с предыдущей отметки к фазе для Server-Timing."""
+        t = time.monotonic()
+        s.timing[phase] = s.timing.get(phase, 0) + (t - s.t_mark) * 1000
+        s.t_mark = t
+
+    def detach(s):
+        """Переносит долгий ответ из пула обработчиков под лимит MAX_STREAMS; False - лимит исчерпан."""
+        if s.slot is s.server.streams: return True
+        if s.slot is not None: s.slot.release()
+        s.slot = None
+        if not s.server.streams.acquire(blocking=False):
+            METRICS.inc('mhstudio_rejected_total', (('limit', 'streams'),))
+            return False
+        s.slot = s.server.streams
+        return True
+
+    def handle_one_request(s):
+        s.status = None
+        try:
+            super().handle_one_request()
+        finally:
+            if s.slot is not None:
+                s.slot.release()
+                s.slot = None
+            if getattr(s, 'profiler', None) is not None:
+                s.profiler.disable()
+                s.prof_lock.release()
+                try:
+                    s.profiler.dump_stats(s.prof_path)
+                except OSError:
+                    pass
+                s.profiler = None
+            if s.status is not None:
+                size = s.headers.get('Content-Length') if s.headers else None
+                METRICS.request(s.route or route_label(getattr(s, 'path', '')), s.status, time.monotonic() - s.t_start,
+                                int(size) if size and size.isdigit() else 0, s.wfile.count)
+
+    def send_response(s, code, message=None):
+        s.status = code
+        super().send_response(code, message)
+        s.served += 1
+        if s.served >= KEEPALIVE_MAX:
+            s.send_header('Connection', 'close')
+
+    def handle_expect_100(s):
+        # 100 Continue без наших Cache-Control заголовков
+        s.send_response_only(100)
         super().end_headers()
+        return True
 
-    def get_bks(s):
-        b = ""
-        for f in sorted(glob.glob(BACKUP_DIR + "/*.yaml"), key=os.path.getmtime, reverse=True)[:10]:
-            n = os.path.basename(f);
-            t = datetime.fromtimestamp(os.path.getmtime(f)).strftime("%d.%m %H:%M")
-            b += f'''<div class="bk-item">
-                    <div><b>{n}</b><span style="font-size:10px;color:var(--txt-sec)">{t}</span></div>
-                    <div class="bk-btns">
-                        <button onclick="viewBackup('{n}')" class="btn-u" title="Просмотр">👁️</button>
-                        <button onclick="restoreBackup('{n}')" class="btn-g" title="Восстановить">↺</button>
-                        <button onclick="delBackup('{n}')" class="btn-d" title="Удалить">✕</button>
-                    </div>
-                   </div>'''
-        if not b: b = '<div style="color:var(--txt-sec);font-size:12px;text-align:center;padding:10px">Нет бэкапов</div>'
-        return b
+    def end_headers(s):
+        if s.cache_ctl is None:
+            s.send_header('Cache-Control', 'no-store, no-cache, must-revalidate');
+            s.send_header('Pragma',
+                          'no-cache');
+            s.send_header(
+                'Expires', '0');
+        elif s.cache_ctl:
+            s.send_header('Cache-Control', s.cache_ctl)
+        s.cache_ctl = None
+        if getattr(s, 'timing', None) is not None:
+            st = [f"{k};dur={v:.1f}" for k, v in s.timing.items()]
+            st.append(f"total;dur={(time.monotonic() - s.t_start) * 1000:.1f}")
+            s.send_header('Server-Timing', ', '.join(st))
+            if s.prof_path: s.send_header('X-Profile', s.prof_path)
+        super().end_headers()
 
-    def get_prof_opts(s):
+    def get_bks(s, q=None):
+        """Страница списка бэкапов из журнала в памяти (?offset=&limit=&profile=&q=)."""
+        q = q or {}
+
+        def num(k, d):
+            try:
+                return max(0, int((q.get(k) or [d])[0]))
+            except ValueError:
+                return d  # ?limit=abc - как без параметра
+        BACKUPS.refresh()
+        return BACKUPS.page(num('offset', 0), min(num('limit', 10), 200),
+                            (q.get('profile') or [''])[0], (q.get('q') or [''])[0])
+
+    def serve_backup(s):
+        """GET /api/backups/<имя>[?diff=<имя>|current]: версия или разница, собранная по цепочке."""
+        u = urllib.parse.urlparse(s.path)
+        name = urllib.parse.unquote(u.path[len('/api/backups/'):])
+        other = (urllib.parse.parse_qs(u.query).get('diff') or [''])[0]
+        e = BACKUPS.entries.get(name)
+        if e is None or (other and other != 'current' and other not in BACKUPS.entries):
+            return s.send_json({'error': 'File not found'}, 404)
+        if not other:
+            # Содержимое версии неизменно - ETag по хэшу
+            return s.send_etag('"' + e['hash'] + '"', lambda: BACKUPS.read(name), 'text/plain;charset=utf-8')
+        if other == 'current':
+            cur = s.read_config()['content']
+            return s.send_body(BACKUPS.diff(name, None, cur).encode('utf-8'), 'text/plain;charset=utf-8')
+        etag = '"' + e['hash'][:16] + BACKUPS.entries[other]['hash'][:16] + '"'
+        s.send_etag(etag, lambda: BACKUPS.diff(name, other).encode('utf-8'), 'text/plain;charset=utf-8')
+
+    def get_profiles(s):
         curr = ""
         if os.path.exists(CONFIG_PATH):
             real = os.path.realpath(CONFIG_PATH)
             curr = os.path.splitext(os.path.basename(real))[0]
-
-        opts = ""
         files = sorted(glob.glob(PROFILES_DIR + "/*.yaml"))
-        for f in files:
-            n = os.path.splitext(os.path.basename(f))[0]
-            sel = "selected" if n == curr else ""
-            opts += f'<option value="{n}" {sel}>{n}</option>'
-        return opts
-
-    def get_panel_port(self):
-        panel_port = ''
+        return {'profiles': [os.path.splitext(os.path.basename(f))[0] for f in files], 'current': curr}
+
+    def serve_static(s, name):
+        if not re.match(r'^[\w.-]+\.js$', name): return s.send_error(404)
+        a = static_asset(name)
+        if a is None:
+            # Локальной копии нет - отдаём CDN, как раньше
+            s.send_response(302)
+            s.send_header('Location', ACE_CDN + '/' + name)
+            s.send_header('Content-Length', '0')
+            s.end_headers()
+            return
+        s.cache_ctl = STATIC_CACHE_CTL
+        s.send_etag(a['etag'], lambda: a['raw'], 'application/javascript; charset=utf-8', gz=a['gz'])
+
+    def send_body(s, body, ctype, code=200, etag=None, gz=None):
+        """Отправляет готовое тело; gz - заранее сжатая версия (статика)."""
+        enc = accept_encoding(s.headers.get('Accept-Encoding')) if len(body) >= GZIP_MIN else None
+        if enc == 'gzip' and gz is not None:
+            body = gz
+        elif enc and gz is None:
+            body = compress(body, enc)
+        else:
+            enc = None
+        s.mark('serialize')
+        s.send_response(code)
+        s.send_header('Content-Type', ctype)
+        s.send_header('Content-Length', str(len(body)))
+        if etag: s.send_header('ETag', etag)
+        if enc: s.send_header('Content-Encoding', enc)
+        s.send_header('Vary', 'Accept-Encoding')
+        s.end_headers()
+        s.wfile.write(body)
+
+    def send_etag(s, etag, build, ctype='application/json', gz=None):
+        """Отдаёт ресурс с ETag; build() вызывается только если клиентская копия устарела."""
+        if s.cache_ctl is None:
+            s.cache_ctl = 'no-cache'  # браузер хранит копию, но каждый раз сверяет ETag
+        if s.headers.get('If-None-Match') == etag:
+            s.send_response(304)
+            s.send_header('ETag', etag)
+            s.end_headers()
+            return
+        body = build()
+        s.mark('transform')
+        if not isinstance(body, bytes): body = json.dumps(body).encode('utf-8')
+        s.send_body(body, ctype, etag=etag, gz=gz)
+
+    def read_config(s):
+        c = "proxies:\n"
+        if os.path.exists(CONFIG_PATH):
+            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+                c = f.read()
+        return {'content': c, 'version': config_version(c), 'profile': s.get_profiles()['current']}
+
+    def start_chunked(s, ctype, code=200):
+        """Начинает ответ неизвестной длины; возвращает write(bytes), write(b'') завершает."""
+        s.send_response(code)
+        s.send_header('Content-Type', ctype)
+        chunked = s.request_version == 'HTTP/1.1'
+        if chunked:
+            s.send_header('Transfer-Encoding', 'chunked')
+        else:
+            s.send_header('Connection', 'close')
+        s.end_headers()
+
+        def write(b):
+            if chunked:
+                s.wfile.write(b'%x\r\n' % len(b) + b + b'\r\n')
+            elif b:
+                s.wfile.write(b)
+        return write
+
+    def stream_subscription(s):
+        """POST /api/subscription: сырое тело подписки -> JSON со списком прокси.
+
+        И вход, и выход обрабатываются потоком, кусками по ~SUB_CHUNK.
+        """
+        length = int(s.headers.get('Content-Length', 0))
+        write = s.start_chunked('application/json')
+        out = bytearray(b'{"items": [')
+        ok = bad = 0
+        err = None
         try:
-            with open(CONFIG_PATH, 'r') as f:
-                config_content = f.read()
-                # Улучшенный regex для поиска порта (учитывает кавычки и IP)
-                # Ищет external-controller: "0.0.0.0:9090" или '127.0.0.1:9090' или просто :9090
-                match = re.search(r"external-controller:\s*(?:['\"]?)(?:[^:]*):(\d+)(?:['\"]?)", config_content)
-                if match:
-                    panel_port = match.group(1)
-        except (IOError, FileNotFoundError):
-            pass
-        return panel_port
+            for item in decode_subscription(iter_body(s.rfile, length, SUB_CHUNK)):
+                if ok or bad: out += b', '
+                out += json.dumps(item).encode('utf-8')
+                if 'error' in item: bad += 1
+                else: ok += 1
+                if len(out) >= SUB_CHUNK:
+                    write(bytes(out))
+                    out.clear()
+        except ValueError as e:
+            err = str(e)
+            s.close_connection = True  # остаток тела не дочитан
+        out += ('], "ok": %d, "errors": %d, "error": %s}' % (ok, bad, json.dumps(err))).encode('utf-8')
+        write(bytes(out))
+        write(b'')
+
+    def upload_wg_archive(s):
+        """POST /api/wg_archive: архив .conf -> список прокси для пакетной вставки."""
+        length = int(s.headers.get('Content-Length', 0))
+        if length > WG_ARCHIVE_MAX:
+            s.close_connection = True
+            s.send_json({'error': 'Archive too large'}, 413)
+            return
+        body = BodyReader(s.rfile, length)
+        try:
+            items = parse_wg_archive(body, {p['name'] for p in config_index().proxies()})
+        except WG_ARCHIVE_ERRORS as e:
+            s.close_connection = body.left > 0
+            s.send_json({'error': 'Unsupported archive: ' + str(e)})
+            return
+        body.read()  # хвост архива (паддинг tar), чтобы соединение осталось пригодным
+        bad = sum(1 for it in items if 'error' in it)
+        s.send_json({'items': items, 'ok': len(items) - bad, 'errors': bad})
+
+    def stream_job_log(s, job, offset):
+        """SSE: новые строки LOG_FILE по мере появления, затем событие done.
+
+        id события - смещение в файле, поэтому EventSource после обрыва
+        продолжает с места остановки (Last-Event-ID).
+        """
+        if not s.detach(): return s.send_error(503, "Too many streams")
+        s.cache_ctl = 'no-cache'
+        write = s.start_chunked('text/event-stream')
+        s.connection.settimeout(None)
+        s.close_connection = True
+        while True:
+            running = job['state'] == 'running'
+            try:
+                with open(LOG_FILE, 'rb') as f:
+                    f.seek(offset)
+                    data = f.read(PROXY_CHUNK)
+            except OSError:
+                data = b''
+            # Не режем многобайтовый символ: отдаём только целые строки, пока задача идёт
+            cut = data.rfind(b'\n') + 1 if running else len(data)
+            if not cut and len(data) == PROXY_CHUNK:
+                cut = utf8_cut(data)  # строка длиннее буфера - отдаём её кусками
+            if cut:
+                offset += cut
+                msg = json.dumps({'text': data[:cut].decode('utf-8', 'replace')})
+                write(f"id: {offset}\nevent: log\ndata: {msg}\n\n".encode('utf-8'))
+                continue
+            if not running:
+                write(f"event: done\ndata: {json.dumps(job)}\n\n".encode('utf-8'))
+                write(b'')
+                return
+            time.sleep(LOG_POLL)
+
+    def send_json(s, obj, code=200):
+        s.mark('transform')
+        s.send_body(json.dumps(obj).encode('utf-8'), 'application/json', code)
 
     # --- PROXY LOGIC ---
     def proxy_pass(self, method):
-        panel_port = self.get_panel_port()
+        ctrl = controller_info()
+        host, panel_port = ctrl['host'], ctrl['port']
         if not panel_port:
             self.send_error(500, "Panel port not found in config")
             return
 
         # Strip prefix
         rel_path = self.path.replace('/mihomo_panel/', '', 1)
-        target_url = f"http://127.0.0.1:{panel_port}/{rel_path}"
 
-        # Read Body
+        if 'websocket' in self.headers.get('Upgrade', '').lower():
+            self.ws_tunnel(host, panel_port, rel_path)
+            return
+
+        headers = {k: v for k, v in self.headers.items()
+                   if k.lower() not in ['host', 'origin', 'referer'] and k.lower() not in HOP_HEADERS}
+        # Важно: подменяем Host для корректной работы backend
+        headers['Host'] = f'{host}:{panel_port}'
+
+        # Body передаём потоком, а не читаем целиком
         content_len = int(self.headers.get('Content-Length', 0))
-        body = self.rfile.read(content_len) if content_len > 0 else None
+        body = iter_body(self.rfile, content_len) if content_len > 0 else None
 
-        # Create Request
+        conn = None
+        try:
+            # Запрос с телом не повторить, поэтому он не рискует устаревшим соединением из пула
+            if body is None:
+                conn, reused = CTRL_POOL.get(host, int(panel_port))
+            else:
+                conn, reused = http.client.HTTPConnection(host, int(panel_port)), False
+            t0 = time.monotonic()
+            try:
+                conn.request(method, '/' + rel_path, body=body, headers=headers)
+                resp = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # Контроллер закрыл keep-alive соединение между проверкой и запросом.
+                # Повторять можно только если тело ещё не начали читать у клиента
+                if not reused: raise
+                conn.close()
+                conn = http.client.HTTPConnection(host, int(panel_port))
+                conn.request(method, '/' + rel_path, headers=headers)
+                resp = conn.getresponse()
+            self.mark('upstream')
+            METRICS.observe('mhstudio_upstream_seconds', (('method', method),), time.monotonic() - t0)
+            self.relay_response(resp, resp.status)
+            CTRL_POOL.put(conn, resp)
+            conn = None
+        except Exception as e:
+            # Silent fail to avoid crashing (в т.ч. клиент закрыл вкладку посреди потока).
+            # Ответ мог оборваться или остаться непрочитанным тело - соединение не переиспользуем
+            self.close_connection = True
+            if self.status is None:
+                # Заголовки ещё не ушли (контроллер недоступен или оборвал запрос) - клиенту нужен статус
+                try:
+                    self.send_error(502, "Controller unavailable")
+                except OSError:
+                    pass
+        finally:
+            if conn is not None: conn.close()
+
+    def ws_tunnel(self, host, panel_port, rel_path):
+        """Пробрасывает WebSocket (traffic/logs/connections) как сырой TCP-туннель.
+
+        Handshake пересылается контроллеру как есть, дальше байты кадров
+        копируются в обе стороны без разбора. Клиент не шлёт кадры до ответа 101,
+        поэтому в буфере rfile после заголовков ничего не остаётся. Туннель без
+        трафика дольше WS_IDLE закрывается; в метрики он попадает при закрытии.
+        """
+        self.close_connection = True
+        if not self.detach():
+            self.send_error(503, "Too many streams")
+            return
+        try:
+            up = socket.create_connection((host, int(panel_port)), timeout=5)
+        except OSError:
+            self.send_error(502, "Controller unavailable")
+            return
         try:
-            req = urllib.request.Request(target_url, data=body, method=method)
+            head = [f"{self.command} /{rel_path} HTTP/1.1", f"Host: {host}:{panel_port}"]
             for k, v in self.headers.items():
                 if k.lower() not in ['host', 'origin', 'referer']:
-                    req.add_header(k, v)
-
-            # Важно: подменяем Host для корректной работы backend
-            req.add_header('Host', f'127.0.0.1:{panel_port}')
-
-            with urllib.request.urlopen(req) as resp:
-                self.send_response(resp.status)
-                for k, v in resp.getheaders():
-                    # Фильтруем CORS заголовки от backend, т.к. мы их сами выставим если надо,
-                    # но здесь мы действуем как same-origin
-                    if k.lower() not in ['access-control-allow-origin', 'server', 'date']:
-                        self.send_header(k, v)
-                self.end_headers()
-                self.wfile.write(resp.read())
-
-        except urllib.error.HTTPError as e:
-            self.send_response(e.code)
-            for k, v in e.headers.items():
+                    head.append(f"{k}: {v}")
+            up.sendall(("\r\n".join(head) + "\r\n\r\n").encode('latin-1'))
+            # Ответ контроллера читается целиком до пустой строки, чтобы знать настоящий статус
+            resp = b''
+            while b'\r\n\r\n' not in resp and len(resp) < 65536:
+                buf = up.recv(PROXY_CHUNK)
+                if not buf: break
+                resp += buf
+            line = resp.split(b'\r\n', 1)[0].split()
+            code = int(line[1]) if len(line) > 1 and line[1].isdigit() else 0
+        except OSError:
+            up.close()
+            self.send_error(502, "Controller unavailable")
+            return
+        if code != 101:
+            up.close()
+            self.send_error(502, f"Controller refused WebSocket ({code or 'no answer'})")
+            return
+        self.status = 101
+        self.log_request(101)
+
+        cl = self.connection
+        up.settimeout(None)
+        cl.settimeout(None)  # туннель живёт дольше KEEPALIVE_IDLE, простой ограничивает select
+        pair = {cl: up, up: cl}
+        try:
+            cl.sendall(resp)
+            self.wfile.count += len(resp)
+            while True:
+                ready, _, _ = select.select([cl, up], [], [], WS_IDLE)
+                if not ready: return  # простой - закрываем обе стороны
+                for src in ready:
+                    buf = src.recv(PROXY_CHUNK)
+                    if not buf: return  # одна из сторон закрылась - закрываем обе
+                    pair[src].sendall(buf)
+                    if src is up: self.wfile.count += len(buf)
+        except OSError:
+            pass
+        finally:
+            up.close()
+
+    def relay_response(self, resp, status):
+        no_body = self.command == 'HEAD' or status in (204, 304) or 100 <= status < 200
+        streaming = resp.getheader('Content-Length') is None and not no_body
+        if streaming and not self.detach():
+            self.send_error(503, "Too many streams")
+            return
+        self.send_response(status)
+        self.cache_ctl = ''  # кэшированием ответов контроллера управляет сам mihomo
+        for k, v in resp.headers.items():
+            # Фильтруем CORS заголовки от backend, т.к. мы их сами выставим если надо,
+            # но здесь мы действуем как same-origin
+            if k.lower() not in ['access-control-allow-origin', 'server', 'date'] and k.lower() not in HOP_HEADERS:
                 self.send_header(k, v)
-            self.end_headers()
-            self.wfile.write(e.read())
-        except Exception as e:
-            # self.send_error(500, str(e))
-            pass  # Silent fail to avoid crashing
+        chunked = False
+        if streaming:
+            # Длина заранее неизвестна (потоковый ответ)
+            if self.request_version == 'HTTP/1.1':
+                self.send_header('Transfer-Encoding', 'chunked')
+                chunked = True
+            else:
+                self.send_header('Connection', 'close')
+        self.end_headers()
+        if not no_body:
+            copy_stream(resp, self.wfile, chunked=chunked)
 
     def do_GET(s):
         if s.path.startswith('/mihomo_panel/'):
             s.proxy_pass('GET')
             return
 
-        if s.path != '/': return s.send_error(404)
-        c = open(CONFIG_PATH).read() if os.path.exists(CONFIG_PATH) else "proxies:\n"
+        if s.path.startswith(ACE_URL + '/'):
+            return s.serve_static(s.path[len(ACE_URL) + 1:].split('?')[0])
+
+        if s.path == '/api/controller':
+            info = dict(controller_info())
+            info['secret'] = '***' if info['secret'] else ''
+            return s.send_json(info)
+
+        if s.path == '/api/config':
+            return s.send_etag(file_etag(CONFIG_PATH), s.read_config)
+        if s.path.startswith('/api/jobs/'):
+            parts = s.path.split('?')[0].split('/')
+            job = JOBS.get(parts[3]) if len(parts) > 3 else None
+            if job is None: return s.send_json({'error': 'Job not found'}, 404)
+            if len(parts) > 4 and parts[4] == 'log':
+                last = (s.headers.get('Last-Event-ID') or '').strip()
+                # id - смещение в логе; мусор в заголовке - читаем лог с начала
+                return s.stream_job_log(job, int(last) if last.isdigit() else 0)
+            return s.send_json(job)
+        if s.path.split('?')[0] == '/api/delay':
+            # ?group=<имя> (можно несколько), ?fresh=1 - без кэша, ?cached=1 - только кэш
+            q = urllib.parse.parse_qs(urllib.parse.urlparse(s.path).query)
+            t0 = time.monotonic()
+            names = delay_names(q.get('group'))
+            # Замеры идут секундами: обработчик уходит из пула под лимит долгих ответов
+            res = delay_batch(names[:DELAY_MAX], fresh=bool(q.get('fresh')), cached_only=bool(q.get('cached')), start=s.detach)
+            if res is None: return s.send_error(503, "Too many streams")
+            if len(names) > DELAY_MAX: res['skipped'] = len(names) - DELAY_MAX
+            res['ms'] = round((time.monotonic() - t0) * 1000)
+            return s.send_json(res)
+        if s.path == '/metrics':
+            return s.send_body(METRICS.render().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8')
+        if s.path == '/api/outline':
+            return s.send_etag(file_etag(CONFIG_PATH), lambda: config_index().outline())
+        if s.path == '/api/profiles':
+            return s.send_etag(file_etag(PROFILES_DIR, CONFIG_PATH), s.get_profiles)
+        if s.path.startswith('/api/backups/'):
+            return s.serve_backup()
+        if s.path.split('?')[0] == '/api/backups':
+            BACKUPS.refresh()
+            u = urllib.parse.urlparse(s.path)
+            etag = '"' + hashlib.sha1(repr((BACKUPS.stamp, u.query)).encode('utf-8')).hexdigest()[:16] + '"'
+            return s.send_etag(etag, lambda: s.get_bks(urllib.parse.parse_qs(u.query)))
 
-        s.send_response(200);
-        s.send_header('Content-type', 'text/html;charset=utf-8');
-        s.end_headers()
-        out = HTML_TEMPLATE.replace('__JSON_CONTENT__', json.dumps(c)) \
-            .replace('__BACKUPS__', s.get_bks()) \
-            .replace('__PROFILES__', s.get_prof_opts()) \
-            .replace('__TIME__', datetime.now().strftime("%H:%M:%S"))
-        s.wfile.write(out.encode('utf-8'))
+        if s.path != '/': return s.send_error(404)
+        s.send_etag(SHELL_ETAG, lambda: SHELL_HTML, 'text/html;charset=utf-8', gz=SHELL_GZ)
 
     def do_POST(s):
         if s.path.startswith('/mihomo_panel/'):
             s.proxy_pass('POST')
             return
+        if s.path == '/api/subscription':
+            s.stream_subscription()
+            return
+        if s.path == '/api/wg_archive':
+            s.upload_wg_archive()
+            return
 
         l = int(s.headers['Content-Length']);
         d = s.rfile.read(l).decode('utf-8', 'ignore')
+        s.mark('read')
         p = {k: v[0] for k, v in urllib.parse.parse_qs(d).items()};
         a = p.get('act')
-        s.send_response(200);
-        s.send_header('Content-Type', 'application/json');
-        s.end_headers()
+        s.mark('parse')
+        s.route = action_label(a)
 
         # --- PROFILE ACTIONS ---
         if a == 'switch_prof':
@@ -1558,9 +3654,9 @@ class H(http.server.SimpleHTTPRequestHandler):
                 if os.path.exists(CONFIG_PATH) or os.path.islink(CONFIG_PATH):
                     os.unlink(CONFIG_PATH)
                 os.symlink(target, CONFIG_PATH)
-                s.wfile.write(json.dumps({'status': 'ok'}).encode('utf-8'))
+                s.send_json({'status': 'ok'})
             else:
-                s.wfile.write(json.dumps({'error': 'Profile not found'}).encode('utf-8'))
+                s.send_json({'error': 'Profile not found'})
             return
 
         if a == 'add_prof':
@@ -1568,12 +3664,12 @@ class H(http.server.SimpleHTTPRequestHandler):
             c = p.get('content', '')
             target = os.path.join(PROFILES_DIR, n + ".yaml")
             if os.path.exists(target):
-                s.wfile.write(json.dumps({'error': 'Профиль с таким именем уже существует'}).encode('utf-8'))
+                s.send_json({'error': 'Профиль с таким именем уже существует'})
             else:
                 with open(target, 'w') as f:
                     f.write(c)
                 if not os.path.exists(CONFIG_PATH): os.symlink(target, CONFIG_PATH)
-                s.wfile.write(json.dumps({'status': 'ok'}).encode('utf-8'))
+                s.send_json({'status': 'ok'})
             return
 
         if a == 'del_prof':
@@ -1581,14 +3677,12 @@ class H(http.server.SimpleHTTPRequestHandler):
             target = os.path.join(PROFILES_DIR, n + ".yaml")
             real_curr = os.path.realpath(CONFIG_PATH)
             if os.path.realpath(target) == real_curr:
-                s.wfile.write(
-                    json.dumps({'error': 'Нельзя удалить активный профиль. Сначала переключитесь на другой.'}).encode(
-                        'utf-8'))
+                s.send_json({'error': 'Нельзя удалить активный профиль. Сначала переключитесь на другой.'})
             elif os.path.exists(target):
                 os.remove(target)
-                s.wfile.write(json.dumps({'status': 'ok'}).encode('utf-8'))
+                s.send_json({'status': 'ok'})
             else:
-                s.wfile.write(json.dumps({'error': 'File not found'}).encode('utf-8'))
+                s.send_json({'error': 'File not found'})
             return
 
         if a == 'get_prof_content':
@@ -1597,9 +3691,9 @@ class H(http.server.SimpleHTTPRequestHandler):
             if os.path.exists(target):
                 with open(target, 'r', encoding='utf-8') as f:
                     content = f.read()
-                s.wfile.write(json.dumps({'status': 'ok', 'content': content}).encode('utf-8'))
+                s.send_json({'status': 'ok', 'content': content})
             else:
-                s.wfile.write(json.dumps({'error': 'Profile not found'}).encode('utf-8'))
+                s.send_json({'error': 'Profile not found'})
             return
 
         if a == 'rename_proxy':
@@ -1607,30 +3701,11 @@ class H(http.server.SimpleHTTPRequestHandler):
             new_name = p.get('new_name')
             content = p.get('content', '')
             if not all([old_name, new_name, content]):
-                s.wfile.write(json.dumps({'error': 'Missing parameters'}).encode('utf-8'))
+                s.send_json({'error': 'Missing parameters'})
                 return
 
-            # 1. Замена в определении прокси: - name: "old_name"
-            # Regex для поиска `name: 'old_name'`, `name: "old_name"` или `name: old_name`
-            # Используем `re.escape` для безопасности
-            escaped_old = re.escape(old_name)
-            # (?P<quote>['"]?) - захватывает кавычку (если она есть) в группу 'quote'
-            # \\1 - ссылается на захваченную кавычку, чтобы заменить на такую же
-            pattern_def = r"(name\s*:\s*)(?P<quote>['\"]?)" + escaped_old + r"(?P=quote)"
-            # Заменяем, сохраняя оригинальные кавычки
-            content = re.sub(pattern_def, r'\g<1>"' + new_name + '"', content, count=1)
-
-            # 2. Замена в списках proxy-groups: - "old_name"
-            # Regex для поиска `- 'old_name'`, `- "old_name"` или `- old_name`
-            pattern_list = r"(-\s+)(?P<quote>['\"]?)" + escaped_old + r"(?P=quote)"
-            content = re.sub(pattern_list, r'\g<1>"' + new_name + '"', content)
-
-            # 3. Замена в Inline Lists: [ ..., "old_name", ... ]
-            # Ищем old_name внутри delimiters [ или , с последующим , или ]
-            pattern_inline = r"([\[,]\s*)(?P<q>['\"]?)" + escaped_old + r"(?P=q)(\s*[,\]])"
-            content = re.sub(pattern_inline, r'\1\g<q>' + new_name + r'\g<q>\3', content)
-
-            s.wfile.write(json.dumps({'status': 'ok', 'new_content': content}).encode('utf-8'))
+            content = rename_proxy(content, old_name, new_name)
+            s.send_json({'status': 'ok', 'new_content': content})
             return
 
         # --- EXISTING ACTIONS ---
@@ -1639,22 +3714,22 @@ class H(http.server.SimpleHTTPRequestHandler):
             link = p.get('link', '')
             custom_name = p.get('proxy_name')
             d, e = parse_vless(link, custom_name)
-            s.wfile.write(json.dumps(d if d else {'error': e}).encode('utf-8'));
+            s.send_json(d if d else {'error': e});
             return
 
         if a == 'add_wireguard':
             config_text = p.get('config_text', '')
             custom_name = p.get('proxy_name')
             if not config_text:
-                s.wfile.write(json.dumps({'error': 'Empty config'}).encode('utf-8'))
+                s.send_json({'error': 'Empty config'})
                 return
 
             proxy_data, err = parse_wireguard(config_text, custom_name)
             if err:
-                s.wfile.write(json.dumps({'error': err}).encode('utf-8'))
+                s.send_json({'error': err})
                 return
 
-            s.wfile.write(json.dumps(proxy_data).encode('utf-8'))
+            s.send_json(proxy_data)
             return
 
         if a == 'apply_insert':
@@ -1672,7 +3747,21 @@ class H(http.server.SimpleHTTPRequestHandler):
                     break
             if not inserted: lines.append("proxies:"); lines.extend(["  " + l for l in p_yaml.splitlines()])
             uc = insert_proxy_logic("\n".join(lines), p_name, targets)
-            s.wfile.write(json.dumps({'new_content': uc}).encode('utf-8'));
+            s.send_json({'new_content': uc});
+            return
+
+        if a == 'apply_insert_batch':
+            try:
+                items = json.loads(p.get('items', '[]'))
+                targets = json.loads(p.get('targets', '[]'))
+            except ValueError as e:
+                s.send_json({'error': str(e)}, 400)
+                return
+            if not isinstance(items, list) or not isinstance(targets, list) or not all(isinstance(t, str) for t in targets):
+                s.send_json({'error': 'items and targets must be lists, targets - of group names'}, 400)
+                return
+            uc, report, groups = insert_proxies_batch(p.get('content', ''), items, targets)
+            s.send_json({'new_content': uc, 'report': report, 'groups': groups})
             return
 
         if a == 'replace_proxy':
@@ -1682,66 +3771,86 @@ class H(http.server.SimpleHTTPRequestHandler):
 
             new_yaml_lines = new_yaml.splitlines()
             uc = replace_proxy_block(content, target_name, new_yaml_lines)
-            s.wfile.write(json.dumps({'new_content': uc}).encode('utf-8'))
+            s.send_json({'new_content': uc})
             return
 
         if a == 'clean_backups':
             limit = int(p.get('limit', 5))
-            files = sorted(glob.glob(BACKUP_DIR + "/*.yaml"), key=os.path.getmtime, reverse=True)
-            if len(files) > limit:
-                for f in files[limit:]:
-                    try:
-                        os.remove(f)
-                    except:
-                        pass
-            s.wfile.write(json.dumps({'backups': s.get_bks()}).encode('utf-8'));
+            BACKUPS.keep_latest(limit)
+            s.send_json({'status': 'ok'});
             return
 
         if a == 'del_backup':
-            fname = p.get('f')
-            path = os.path.join(BACKUP_DIR, os.path.basename(fname))
-            if os.path.exists(path): os.remove(path)
-            s.wfile.write(json.dumps({'backups': s.get_bks()}).encode('utf-8'));
+            BACKUPS.remove([os.path.basename(p.get('f', ''))])
+            s.send_json({'status': 'ok'});
             return
 
         if a == 'rest':
-            shutil.copy(os.path.join(BACKUP_DIR, os.path.basename(p.get('f'))), CONFIG_PATH)
-            s.wfile.write(json.dumps({'status': 'ok'}).encode('utf-8'));
+            data = BACKUPS.read(os.path.basename(p.get('f', '')))
+            if data is None:
+                s.send_json({'error': 'File not found'})
+                return
+            with CONFIG_LOCK:
+                atomic_write(os.path.realpath(CONFIG_PATH), data)
+            s.send_json({'status': 'ok'});
             return
 
         if a == 'view_backup':
-            fname = p.get('f')
-            path = os.path.join(BACKUP_DIR, os.path.basename(fname))
-            if os.path.exists(path):
-                with open(path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                s.wfile.write(json.dumps({'content': content}).encode('utf-8'))
+            data = BACKUPS.read(os.path.basename(p.get('f', '')))
+            if data is not None:
+                s.send_json({'content': data.decode('utf-8', 'replace')})
             else:
-                s.wfile.write(json.dumps({'error': 'File not found'}).encode('utf-8'))
+                s.send_json({'error': 'File not found'})
             return
 
-        new_c = p.get('content', '').replace('\r\n', '\n')
-        if a in ['save', 'restart']:
-            if os.path.exists(CONFIG_PATH):
-                real_p = os.path.basename(os.path.realpath(CONFIG_PATH))
-                prof_n = os.path.splitext(real_p)[0]
-                ts = datetime.now().strftime('%Y%m%d_%H%M%S')
-                shutil.copy(CONFIG_PATH, f"{BACKUP_DIR}/{prof_n}_{ts}.yaml")
-
-            with open(CONFIG_PATH, 'w') as f:
-                f.write(new_c);
-                f.flush();
-                os.fsync(f.fileno())
-
-        if a == 'restart':
-            my_env = os.environ.copy();
-            my_env["TERM"] = "xterm-256color"
-            subprocess.run(RESTART_CMD, shell=True, env=my_env)
-            log = open(LOG_FILE).read() if os.path.exists(LOG_FILE) else "Log empty"
-            s.wfile.write(json.dumps({'log': log}).encode('utf-8'))
+        if a == 'save_patch':
+            # Инкрементальное сохранение: правки относительно версии base
+            with CONFIG_LOCK:
+                cur = s.read_config()['content']
+                ver = config_version(cur)
+                if ver != p.get('base'):
+                    s.send_json({'error': 'stale', 'version': ver}, 409)
+                    return
+                try:
+                    edits = json.loads(p.get('edits', '[]'))
+                    new_c = apply_line_edits(cur, edits)
+                except (ValueError, KeyError, TypeError) as e:
+                    s.send_json({'error': str(e)}, 400)
+                    return
+                s.mark('transform')
+                wr = write_config(new_c)
+                s.mark('fsync')
+                index_after_patch(ver, edits, new_c)
+            a = p.get('mode') if p.get('mode') in ('restart', 'reload') else 'save'
+        elif a in ['save', 'restart', 'reload']:
+            new_c = p.get('content', '').replace('\r\n', '\n')
+            with CONFIG_LOCK:
+                cur = s.read_config()['content'] if a == 'reload' else None
+                s.mark('transform')
+                wr = write_config(new_c)
+                s.mark('fsync')
+
+        if a == 'reload':
+            # Применяем через API контроллера; рестарт только если без него не обойтись
+            why = restart_reason(cur, new_c)
+            if why is None:
+                t0 = time.monotonic()
+                ok, err = controller_reload(new_c)
+                if ok:
+                    s.send_json({'status': 'ok', 'reloaded': True, 'ms': round((time.monotonic() - t0) * 1000),
+                                 'time': datetime.now().strftime("%H:%M:%S"),
+                                 'version': config_version(new_c), 'timing': wr['timing']})
+                    return
+                why = 'controller: ' + err
+            s.send_json({'job': start_restart_job(), 'reason': why, 'version': config_version(new_c)})
+        elif a == 'restart':
+            # Рестарт идёт в фоне, лог читается через /api/jobs/<id>/log (SSE)
+            s.send_json({'job': start_restart_job(), 'version': config_version(new_c)})
         elif a == 'save':
-            s.wfile.write(json.dumps(
-                {'status': 'ok', 'time': datetime.now().strftime("%H:%M:%S"), 'backups': s.get_bks()}).encode('utf-8'))
+            s.send_json({'status': 'ok', 'time': datetime.now().strftime("%H:%M:%S"), 'unchanged': not wr['changed'],
+                         'version': config_version(new_c), 'timing': wr['timing']})
+        else:
+            s.send_json({'error': 'Unknown action'})
 
     def do_PUT(s):
         if s.path.startswith('/mihomo_panel/'):
@@ -1756,8 +3865,64 @@ class H(http.server.SimpleHTTPRequestHandler):
         s.send_error(405, "Method Not Allowed")
 
 
-try:
-    socketserver.TCPServer.allow_reuse_address = True;
-    socketserver.TCPServer(("", PORT), H).serve_forever()
-except Exception as e:
-    print(e)
+class StudioServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Многопоточный сервер с ограничением числа одновременных обработчиков."""
+    allow_reuse_address = True
+    daemon_threads = True
+    # Очередь accept: при стандартных 5 пачка соединений от дашборда теряет SYN и ждёт повтора ~1 с
+    request_queue_size = 64
+
+    busy = b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nRetry-After: 1\r\nConnection: close\r\n\r\n"
+
+    def __init__(s, addr, handler, max_workers=MAX_WORKERS, max_streams=MAX_STREAMS, max_conns=MAX_CONNECTIONS):
+        s.slots = threading.BoundedSemaphore(max(1, max_workers))  # запросы в работе, см. H.parse_request
+        s.streams = threading.BoundedSemaphore(max(1, max_streams))  # долгие ответы, см. H.detach
+        s.conns = threading.BoundedSemaphore(max(1, max_conns))
+        super().__init__(addr, handler)
+
+    def process_request(s, request, client_address):
+        # Поток accept никогда не ждёт (иначе не дойдёт и до shutdown): сверх лимита соединений - сразу 503
+        if not s.conns.acquire(blocking=False):
+            METRICS.inc('mhstudio_rejected_total', (('limit', 'connections'),))
+            try:
+                request.setblocking(False)
+                request.send(s.busy)
+            except OSError:
+                pass
+            s.shutdown_request(request)
+            return
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            s.conns.release()
+            raise
+
+    def process_request_thread(s, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            s.conns.release()
+
+
+def run():
+    BACKUPS.load()
+    srv = StudioServer(("", PORT), H)
+
+    def stop(signum, frame):
+        # shutdown() нельзя звать из потока serve_forever - иначе deadlock
+        threading.Thread(target=srv.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        srv.serve_forever()
+    finally:
+        srv.server_close()
+        CTRL_POOL.close()
+
+
+if __name__ == "__main__":
+    try:
+        run()
+    except Exception as e:
+        print(e)
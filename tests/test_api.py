@@ -0,0 +1,458 @@
+# -*- coding: utf-8 -*-
+"""HTTP API студии: сервер поднимается в потоке на свободном порту с временным каталогом."""
+import http.client
+import http.server
+import io
+import json
+import os
+import socket
+import struct
+import sys
+import tarfile
+import tempfile
+import threading
+import unittest
+import unittest.mock as mock
+import urllib.parse
+import zipfile
+
+os.environ["MHSTUDIO_CONFIG_DIR"] = tempfile.mkdtemp(prefix="mhstudio_test_")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import mihomo_editor as me  # noqa: E402
+
+SRV = None
+
+
+def setUpModule():
+    global SRV
+    me.BACKUPS.load()
+    SRV = me.StudioServer(("127.0.0.1", 0), me.H)
+    threading.Thread(target=SRV.serve_forever, daemon=True).start()
+
+
+def tearDownModule():
+    SRV.shutdown()
+    SRV.server_close()
+
+
+def request(method, path, body=None, headers=None, srv=None):
+    conn = http.client.HTTPConnection("127.0.0.1", (srv or SRV).server_address[1], timeout=10)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        resp = conn.getresponse()
+        return resp.status, resp.read()
+    finally:
+        conn.close()
+
+
+def post(form):
+    body = urllib.parse.urlencode(form)
+    return request("POST", "/", body, {"Content-Type": "application/x-www-form-urlencoded"})
+
+
+class BackupListTest(unittest.TestCase):
+    def test_bad_paging_params_use_defaults(self):
+        for i in range(3):
+            post({"act": "save", "content": f"a: {i}"})
+        for q in ("limit=abc", "offset=x", "limit=&offset=-", "limit=1e3&offset=%00"):
+            status, body = request("GET", "/api/backups?" + q)
+            self.assertEqual(status, 200, q)
+            d = json.loads(body)
+            self.assertEqual((d["offset"], d["limit"]), (0, 10), q)
+
+    def test_paging(self):
+        for i in range(3):
+            post({"act": "save", "content": f"b: {i}"})
+        d = json.loads(request("GET", "/api/backups?limit=1&offset=1")[1])
+        self.assertEqual((d["offset"], d["limit"], len(d["items"])), (1, 1, 1))
+
+
+def route_labels():
+    with me.METRICS.lock:
+        return {dict(l)["route"] for (n, l) in me.METRICS.counters if n == "mhstudio_requests_total"}
+
+
+def requests_total():
+    with me.METRICS.lock:
+        return sum(v for (n, _), v in me.METRICS.counters.items() if n == "mhstudio_requests_total")
+
+
+class MetricLabelTest(unittest.TestCase):
+    def junk(self, i):
+        request("GET", f"/api/junk{i}?x={i}")
+        request("GET", f"/no/such/path/{i}")
+        post({"act": f"junk_{i}"})
+
+    def settle(self, total):
+        # метрика пишется после отправки ответа - ждём, пока запись догонит клиента
+        for _ in range(200):
+            if requests_total() >= total: return
+            threading.Event().wait(0.01)
+
+    def test_junk_does_not_add_labels(self):
+        start = requests_total()
+        self.junk(0)
+        self.settle(start + 3)
+        labels = route_labels()
+        self.assertTrue({"other", "act:other"} <= labels)
+        for i in range(1, 21):
+            self.junk(i)
+        self.settle(start + 63)
+        self.assertEqual(route_labels(), labels)
+
+
+
+class InsertBatchTest(unittest.TestCase):
+    CONTENT = "proxies:\n  - name: a\n    type: ss\nproxy-groups:\n  - name: g\n    type: select\n    proxies:\n      - a\n" \
+              "  - name: h\n    type: select\n    proxies: [a]\n"
+
+    def insert(self, items, targets):
+        status, body = post({"act": "apply_insert_batch", "content": self.CONTENT,
+                             "items": json.dumps(items), "targets": json.dumps(targets)})
+        return status, json.loads(body)
+
+    def test_rejects_non_lists(self):
+        for items, targets in (("abc", ["g"]), ({"name": "x"}, ["g"]), ([], "g"), ([], [1])):
+            status, d = self.insert(items, targets)
+            self.assertEqual(status, 400, (items, targets))
+            self.assertIn("error", d)
+
+    def test_non_dict_items_reported(self):
+        status, d = self.insert([1, "x", {"name": "b", "yaml": "- name: b\n  type: ss"}], ["g"])
+        self.assertEqual(status, 200)
+        self.assertEqual([r["status"] for r in d["report"]], ["error", "error", "ok"])
+
+    def test_quoted_member_names(self):
+        name = 'q"x\\y'
+        status, d = self.insert([{"name": name, "yaml": "- name: " + json.dumps(name) + "\n  type: ss"}], ["g", "h"])
+        self.assertEqual(status, 200)
+        self.assertEqual(d["groups"], {"g": 1, "h": 1})
+        idx = me.ConfigIndex(d["new_content"])
+        self.assertIn(name, [p["name"] for p in idx.proxies()])
+        for g in idx.groups():
+            self.assertIn(name, [m["name"] for m in g["members"]], g["name"])
+
+
+
+class EchoHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *a):
+        pass
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.close_connection = False
+
+
+def use_controller(port, proxies="[]"):
+    with open(me.CONFIG_PATH, "w") as f:
+        f.write(f"external-controller: 127.0.0.1:{port}\nproxies: {proxies}\n")
+    me._ctrl_cache["key"] = None
+
+
+class ProxyPassTest(unittest.TestCase):
+    def test_unreachable_controller_is_502(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]  # после закрытия порт никто не слушает
+        use_controller(port)
+        self.assertEqual(request("GET", "/mihomo_panel/version")[0], 502)
+        self.assertEqual(request("PUT", "/mihomo_panel/configs", "{}")[0], 502)
+
+    def test_body_after_pooled_request(self):
+        up = http.server.ThreadingHTTPServer(("127.0.0.1", 0), EchoHandler)
+        threading.Thread(target=up.serve_forever, daemon=True).start()
+        try:
+            use_controller(up.server_address[1])
+            for i in range(3):
+                self.assertEqual(request("PUT", "/mihomo_panel/configs", f'{{"i": {i}}}'), (200, f'{{"i": {i}}}'.encode()))
+        finally:
+            up.shutdown()
+            up.server_close()
+
+
+
+WG_CONF = """[Interface]
+PrivateKey = yAnz5TF+lXXJte14tji3zlMNq+hd2rYUIgJBgB3fBmk=
+Address = 10.8.0.2/32
+
+[Peer]
+PublicKey = xTIBA5rboUvnH4htodjb6e697QjLERt1NAB4mZqp8Dg=
+AllowedIPs = 0.0.0.0/0
+Endpoint = wg.example.com:51820
+"""
+
+
+def zip_bytes(entries, method=None, flags=0):
+    """zip из (имя, текст); method/flags подменяются в заголовках, как у чужих архиваторов."""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        for name, text in entries:
+            zf.writestr(name, text)
+    data = bytearray(buf.getvalue())
+    for sig, off in ((b"PK\x03\x04", 6), (b"PK\x01\x02", 8)):
+        pos = data.find(sig)
+        while pos >= 0:
+            if method is not None: struct.pack_into("<H", data, pos + off + 2, method)
+            struct.pack_into("<H", data, pos + off, struct.unpack_from("<H", data, pos + off)[0] | flags)
+            pos = data.find(sig, pos + 4)
+    return bytes(data)
+
+
+class WgArchiveTest(unittest.TestCase):
+    def upload(self, data):
+        status, body = request("POST", "/api/wg_archive", data, {"Content-Type": "application/octet-stream"})
+        return status, json.loads(body)
+
+    def test_unsupported_method_and_encrypted_entries(self):
+        for kw in ({"method": 99}, {"flags": 1}):
+            status, d = self.upload(zip_bytes([("a.conf", WG_CONF)], **kw))
+            self.assertEqual(status, 200, kw)
+            self.assertEqual(len(d["items"]), 1, kw)
+            self.assertIn("error", d["items"][0], kw)
+
+    def test_corrupt_deflate(self):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("a.conf", WG_CONF * 20)
+        data = bytearray(buf.getvalue())
+        data[40:60] = b"\xff" * 20  # внутри сжатого потока первого файла
+        status, d = self.upload(bytes(data))
+        self.assertEqual(status, 200)
+        self.assertEqual(d["errors"], 1)
+        self.assertTrue(d["items"][0]["error"].startswith("Unreadable entry"))
+
+    def test_unpacked_size_cap(self):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w:gz") as tf:
+            big = tarfile.TarInfo("junk.bin")
+            big.size = me.WG_UNPACK_MAX + 1
+            tf.addfile(big, io.BytesIO(b"\0" * big.size))
+            conf = tarfile.TarInfo("after.conf")
+            conf.size = len(WG_CONF)
+            tf.addfile(conf, io.BytesIO(WG_CONF.encode()))
+        items = me.parse_wg_archive(io.BufferedReader(io.BytesIO(buf.getvalue())))
+        self.assertEqual([(it["file"], it["error"]) for it in items], [("junk.bin", "Archive too large when unpacked")])
+
+    def test_good_archive(self):
+        status, d = self.upload(zip_bytes([("a.conf", WG_CONF), ("b.conf", WG_CONF)]))
+        self.assertEqual((status, d["ok"], d["errors"]), (200, 2, 0))
+
+
+
+class DelayHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    gate = threading.Event()
+
+    def log_message(self, *a):
+        pass
+
+    def do_GET(self):
+        self.gate.wait(10)
+        body = b'{"delay": 42}'
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DelayTest(unittest.TestCase):
+    def setUp(self):
+        me._delay_cache.clear()
+        self.up = http.server.ThreadingHTTPServer(("127.0.0.1", 0), DelayHandler)
+        threading.Thread(target=self.up.serve_forever, daemon=True).start()
+        use_controller(self.up.server_address[1], "".join(f"\n  - {{name: p{i}, type: ss}}" for i in range(3)))
+
+    def tearDown(self):
+        DelayHandler.gate.set()
+        self.up.shutdown()
+        self.up.server_close()
+
+    def test_batch_does_not_hold_worker(self):
+        DelayHandler.gate.clear()
+        srv = me.StudioServer(("127.0.0.1", 0), me.H, max_workers=1)
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        try:
+            res = []
+            t = threading.Thread(target=lambda: res.append(request("GET", "/api/delay?fresh=1", srv=srv)))
+            t.start()
+            threading.Event().wait(0.3)
+            # единственный обработчик свободен, пока замеры ждут контроллер
+            self.assertEqual(request("GET", "/api/profiles", srv=srv)[0], 200)
+            self.assertTrue(t.is_alive())
+            DelayHandler.gate.set()
+            t.join(10)
+            self.assertEqual(res[0][0], 200)
+            self.assertEqual(json.loads(res[0][1])["tested"], 3)
+        finally:
+            srv.shutdown()
+            srv.server_close()
+
+    def test_name_cap(self):
+        DelayHandler.gate.set()
+        old, me.DELAY_MAX = me.DELAY_MAX, 2
+        try:
+            d = json.loads(request("GET", "/api/delay?fresh=1")[1])
+        finally:
+            me.DELAY_MAX = old
+        self.assertEqual((d["tested"], d["skipped"]), (2, 1))
+
+
+
+class JobLogTest(unittest.TestCase):
+    def test_long_line_streams_while_running(self):
+        log = os.path.join(me.CONFIG_DIR, "job.log")
+        text = "я" * me.PROXY_CHUNK  # две строки буфера без перевода строки, буфер режет символ пополам
+        with open(log, "w", encoding="utf-8") as f:
+            f.write(text)
+        old, me.LOG_FILE = me.LOG_FILE, log
+        job = me.JOBS["t-long"] = {"id": "t-long", "state": "running"}
+        conn = http.client.HTTPConnection("127.0.0.1", SRV.server_address[1], timeout=10)
+        try:
+            conn.request("GET", "/api/jobs/t-long/log")
+            resp = conn.getresponse()
+            got = ""
+            while len(got) < len(text):
+                line = resp.readline().decode("utf-8")
+                if line.startswith("data: "): got += json.loads(line[6:])["text"]
+            self.assertEqual(got, text)  # пришло целиком, пока задача ещё идёт
+            job["state"] = "done"
+        finally:
+            job["state"] = "done"
+            me.LOG_FILE = old
+            conn.close()
+
+
+
+class ParseControllerTest(unittest.TestCase):
+    def test_secret_forms(self):
+        for raw, want in (("abc # token", "abc"), ('"abc" # c', "abc"), ("'a # b'", "a # b"), ('"a#b"', "a#b"),
+                          ("abc", "abc"), ('""', ""), ("", "")):
+            self.assertEqual(me.parse_controller(f"secret: {raw}\nmode: rule\n")["secret"], want, raw)
+
+
+
+def get_config():
+    return json.loads(request("GET", "/api/config")[1])
+
+
+class SavePatchTest(unittest.TestCase):
+    def setUp(self):
+        self.assertEqual(post({"act": "save", "content": "mode: rule\nproxies:\n  - name: a\n    type: ss\n"})[0], 200)
+
+    def patch(self, base, edits):
+        status, body = post({"act": "save_patch", "base": base, "edits": json.dumps(edits)})
+        return status, json.loads(body)
+
+    def test_patch_applies_edits(self):
+        cur = get_config()
+        new_c = cur["content"].replace("type: ss", "type: vless\n    udp: true")
+        status, d = self.patch(cur["version"], me.line_edits(cur["content"], new_c))
+        self.assertEqual(status, 200)
+        self.assertEqual(d["version"], me.config_version(new_c))
+        with open(me.CONFIG_PATH, encoding="utf-8") as f:
+            self.assertEqual(f.read(), new_c)
+        self.assertEqual(get_config()["version"], d["version"])
+
+    def test_stale_base_is_409(self):
+        cur = get_config()
+        edits = [{"start": 0, "del": 1, "lines": ["mode: global"]}]
+        self.assertEqual(self.patch(cur["version"], edits)[0], 200)
+        status, d = self.patch(cur["version"], edits)  # та же база уже устарела
+        self.assertEqual(status, 409)
+        self.assertEqual(d["version"], get_config()["version"])
+        self.assertNotEqual(d["version"], cur["version"])
+
+    def test_bad_edits_are_400(self):
+        cur = get_config()
+        for edits in ([{"start": 99, "del": 1, "lines": []}], [{"start": 0}], "x"):
+            status, _ = self.patch(cur["version"], edits)
+            self.assertEqual(status, 400, edits)
+        self.assertEqual(get_config()["content"], cur["content"])
+
+
+
+class SaveTest(unittest.TestCase):
+    def save(self, content):
+        status, body = post({"act": "save", "content": content})
+        self.assertEqual(status, 200)
+        return json.loads(body)
+
+    def test_unchanged_save_writes_nothing(self):
+        self.save("same: 1\n")
+        st, backups = os.stat(me.CONFIG_PATH), len(me.BACKUPS.entries)
+        d = self.save("same: 1\n")
+        self.assertTrue(d["unchanged"])
+        self.assertEqual(d["version"], me.config_version("same: 1\n"))
+        st2 = os.stat(me.CONFIG_PATH)
+        self.assertEqual((st2.st_ino, st2.st_mtime_ns), (st.st_ino, st.st_mtime_ns))
+        self.assertEqual(len(me.BACKUPS.entries), backups)
+        self.assertFalse(self.save("same: 2\n")["unchanged"])
+        self.assertEqual(len(me.BACKUPS.entries), backups + 1)
+
+    def test_save_through_profile_symlink(self):
+        d = tempfile.mkdtemp(prefix="mhstudio_link_")
+        target, link = os.path.join(d, "prof.yaml"), os.path.join(d, "config.yaml")
+        with open(target, "w") as f:
+            f.write("old: 1\n")
+        os.symlink(target, link)
+        old = me.CONFIG_PATH
+        me.CONFIG_PATH = link
+        try:
+            self.assertTrue(me.write_config("new: 1\n")["changed"])
+        finally:
+            me.CONFIG_PATH = old
+        self.assertTrue(os.path.islink(link))
+        with open(target) as f:
+            self.assertEqual(f.read(), "new: 1\n")
+        self.assertEqual(sorted(os.listdir(d)), ["config.yaml", "prof.yaml"])
+
+
+class AtomicWriteTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="mhstudio_aw_")
+        self.path = os.path.join(self.dir, "c.yaml")
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def test_replaces_and_keeps_mode(self):
+        with open(self.path, "wb") as f:
+            f.write(b"old")
+        os.chmod(self.path, 0o600)
+        timing = me.atomic_write(self.path, b"new")
+        self.assertEqual(self.read(), b"new")
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        self.assertEqual(set(timing), {"write", "fsync", "rename"})
+        self.assertEqual(os.listdir(self.dir), ["c.yaml"])
+
+    def test_new_file_is_world_readable(self):
+        me.atomic_write(self.path, b"x")
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o644)
+
+    def test_failed_rename_keeps_old_file(self):
+        with open(self.path, "wb") as f:
+            f.write(b"old")
+        with mock.patch.object(me.os, "replace", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                me.atomic_write(self.path, b"new")
+        self.assertEqual(self.read(), b"old")
+        self.assertEqual(os.listdir(self.dir), ["c.yaml"])
+
+    def test_parallel_writers(self):
+        datas = [bytes([65 + i]) * 100000 for i in range(8)]
+        threads = [threading.Thread(target=me.atomic_write, args=(self.path, d)) for d in datas]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        self.assertIn(self.read(), datas)  # целиком одна из версий, без смеси
+        self.assertEqual(os.listdir(self.dir), ["c.yaml"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""BackupStore на временном каталоге: запись, чтение, журнал и сборка мусора."""
+import gzip
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+
+os.environ.setdefault("MHSTUDIO_CONFIG_DIR", tempfile.mkdtemp(prefix="mhstudio_test_"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import mihomo_editor as me  # noqa: E402
+
+T0 = 1735689600  # 2025-01-01, время записей задаётся явно
+
+
+def version(i):
+    """Конфиг, от версии к версии меняющийся в нескольких местах."""
+    lines = [f"mixed-port: {7890 + i % 3}", "proxies:"]
+    lines += [f"  - {{name: n{k}, type: ss, server: 10.0.{k}.{i}}}" for k in range(i % 7 + 3)]
+    lines += ["rules:", f"  - MATCH,g{i}", ""]
+    return "\n".join(lines).encode("utf-8")
+
+
+class StoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="mhstudio_bk_")
+        self.store = self.reopen()
+
+    def reopen(self):
+        store = me.BackupStore(self.root)
+        store.load()
+        return store
+
+    def blobs(self):
+        return sorted(os.listdir(os.path.join(self.root, "blobs")))
+
+
+class BackupStoreTest(StoreTestCase):
+    def test_add_and_read(self):
+        e = self.store.add("p", b"a: 1\n", T0)
+        self.assertEqual(e["name"], f"p_{datetime.fromtimestamp(T0):%Y%m%d_%H%M%S}.yaml")
+        self.assertEqual(self.store.read(e["name"]), b"a: 1\n")
+        with open(self.store.obj_path(e["hash"]), "rb") as f:
+            self.assertEqual(gzip.decompress(f.read()), b"a: 1\n")
+        self.assertIsNone(self.store.read("missing.yaml"))
+
+    def test_repeat_of_last_version_is_skipped(self):
+        a = self.store.add("p", b"a: 1\n", T0)
+        self.assertIs(self.store.add("p", b"a: 1\n", T0 + 1), a)
+        self.assertEqual(len(self.store.entries), 1)
+        # тот же текст в другом профиле - отдельная запись на общем объекте
+        b = self.store.add("q", b"a: 1\n", T0 + 2)
+        self.assertEqual((b["hash"], len(self.store.entries), len(self.blobs())), (a["hash"], 2, 1))
+
+    def test_same_second_names_do_not_collide(self):
+        names = [self.store.add("p", f"a: {i}\n".encode(), T0)["name"] for i in range(3)]
+        self.assertEqual(len(set(names)), 3)
+        for i, n in enumerate(names):
+            self.assertEqual(self.store.read(n), f"a: {i}\n".encode())
+
+    def test_manifest_survives_reload(self):
+        for i in range(5):
+            self.store.add("p", version(i), T0 + i)
+        self.store.remove([self.store.latest()[2]["name"]])
+        again = self.reopen()
+        self.assertEqual([e["name"] for e in again.latest()], [e["name"] for e in self.store.latest()])
+        for e in again.latest():
+            self.assertEqual(again.read(e["name"]), self.store.read(e["name"]))
+
+    def test_torn_manifest_line_is_ignored(self):
+        self.store.add("p", b"a: 1\n", T0)
+        with open(self.store.manifest, "a") as f:
+            f.write('{"op": "add", "name": "half')
+        self.assertEqual(len(self.reopen().entries), 1)
+
+    def test_legacy_files_are_migrated(self):
+        with open(os.path.join(self.root, "p_20240101_120000.yaml"), "wb") as f:
+            f.write(b"old: 1\n")
+        store = self.reopen()
+        self.assertEqual(store.read("p_20240101_120000.yaml"), b"old: 1\n")
+        self.assertFalse(os.path.exists(os.path.join(self.root, "p_20240101_120000.yaml")))
+
+    def test_page_filters(self):
+        for i in range(4):
+            self.store.add("p" if i % 2 else "q", version(i), T0 + i)
+        d = self.store.page(0, 10, profile="p")
+        self.assertEqual((d["total"], d["profiles"]), (2, ["p", "q"]))
+        self.assertEqual(self.store.page(1, 1)["items"][0]["ts"], T0 + 2)
+
+
+class DeltaChainTest(StoreTestCase):
+    N = 25
+
+    def fill(self, profile="p", n=N, start=0):
+        return [self.store.add(profile, version(i), T0 + start + i) for i in range(n)]
+
+    def assert_readable(self, store, entries):
+        for e in entries:
+            self.assertEqual(store.read(e["name"]), version(e["seq"] - 1), e["name"])
+
+    def test_chain_reads_back_every_version(self):
+        entries = self.fill()
+        self.assert_readable(self.store, entries)
+        self.assert_readable(self.reopen(), entries)
+
+    def test_keyframes_and_head_are_whole(self):
+        entries = self.fill()
+        whole = {e["seq"] for e in entries if self.store.objs[e["hash"]] is None}
+        self.assertEqual(whole, {10, 20, self.N})
+        for e in entries:
+            h, steps = e["hash"], 0
+            while self.store.objs[h]:
+                h, steps = self.store.objs[h], steps + 1
+            self.assertLess(steps, me.BACKUP_KEYFRAME, e["name"])
+
+    def test_remove_and_gc_keep_chains_intact(self):
+        entries = self.fill()
+        gone = entries[1::3]
+        self.store.remove([e["name"] for e in gone])
+        left = [e for e in entries if e not in gone]
+        self.assert_readable(self.store, left)
+        self.assert_readable(self.reopen(), left)
+        before = len(self.blobs())
+        self.store.keep_latest(3)
+        self.assert_readable(self.store, left[-3:])
+        self.assertEqual(len(self.store.entries), 3)
+        self.assertLess(len(self.blobs()), before)
+        # остались только объекты, нужные трём записям и базам их разниц
+        self.assertEqual(len(self.blobs()), len(self.store.objs))
+
+    def test_returning_to_an_old_version(self):
+        a = self.store.add("p", version(0), T0)
+        self.store.add("p", version(1), T0 + 1)
+        c = self.store.add("p", version(0), T0 + 2)
+        self.assertEqual(a["hash"], c["hash"])
+        self.assertIsNone(self.store.objs[c["hash"]])  # снова голова - снова целиком
+        for e in self.store.latest():
+            self.assertEqual(self.store.read(e["name"]), version(0) if e["hash"] == a["hash"] else version(1))
+
+    def test_head_of_another_profile_is_not_demoted(self):
+        self.store.add("q", version(3), T0)
+        self.store.add("p", version(3), T0 + 1)
+        self.store.add("p", version(4), T0 + 2)
+        self.assertIsNone(self.store.objs[self.store.latest(1, "q")[0]["hash"]])
+        self.assertEqual(self.store.read(self.store.latest(1, "q")[0]["name"]), version(3))
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Правки конфига по строкам: line_edits/apply_line_edits и инкрементальный ConfigIndex."""
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+os.environ.setdefault("MHSTUDIO_CONFIG_DIR", tempfile.mkdtemp(prefix="mhstudio_test_"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import mihomo_editor as me  # noqa: E402
+
+CONFIG = "\n".join(
+    ["mixed-port: 7890", "proxies:"]
+    + [l for i in range(20) for l in (f'  - name: "n{i}"', "    type: ss", f"    server: 10.0.0.{i}", "")]
+    + ["  - {name: flow, type: ss, server: 10.0.1.1}", "", "proxy-groups:"]
+    + [l for g in range(4) for l in (f"  - name: g{g}", "    type: select", "    proxies:", "      - n1", "      - n2")]
+    + ["  - {name: inline, type: select, proxies: [n3, n4]}", "", "rules:", "  - DOMAIN,a.com,g0", "  - MATCH,g1", ""])
+
+# Строки для случайных правок: элементы списков, поля, комментарии, чужие отступы и ключи верхнего уровня
+POOL = ['  - name: "x{}"', "    type: ss", "", "# note", "  - {{name: f{}, type: ss}}", "      - n{}",
+        "    proxies: [a, b{}]", "    proxies:", "  -", "    name: late{}", "- name: top{}", "   - name: odd{}",
+        "rules:", "dns:", "  - MATCH,DIRECT"]
+
+
+def outline(idx):
+    o = idx.outline()
+    o.pop("version")
+    return o
+
+
+class ApplyEditsTest(unittest.TestCase):
+    def test_matches_full_rebuild(self):
+        rnd = random.Random(7)
+        for trial in range(300):
+            lines, idx = CONFIG.split("\n"), me.ConfigIndex(CONFIG)
+            for _ in range(4):
+                st = rnd.randrange(len(lines) + 1)
+                n = rnd.randint(0, min(3, len(lines) - st))
+                new = [rnd.choice(POOL).format(rnd.randrange(99)) for _ in range(rnd.randint(0, 3))]
+                lines[st:st + n] = new
+                idx.apply_edits([{"start": st, "del": n, "lines": new}])
+                self.assertEqual(outline(idx), outline(me.ConfigIndex("\n".join(lines))), (trial, st, n, new))
+
+    def test_edit_inside_proxy_keeps_neighbours(self):
+        idx = me.ConfigIndex(CONFIG)
+        p = idx.proxies()[5]
+        idx.apply_edits([{"start": p["start"] + 2, "del": 1, "lines": ["    server: a.example.com", "    port: 1"]}])
+        names = [x["name"] for x in idx.proxies()]
+        self.assertEqual(names[:6], [f"n{i}" for i in range(6)])
+        self.assertEqual(idx.proxies()[6]["start"], p["end"] + 2)
+        self.assertEqual(outline(idx), outline(me.ConfigIndex("\n".join(idx.lines))))
+
+
+class LineEditsTest(unittest.TestCase):
+    def test_round_trip(self):
+        rnd = random.Random(3)
+        base = CONFIG.split("\n")
+        for trial in range(200):
+            new = list(base)
+            for _ in range(rnd.randint(1, 5)):
+                st = rnd.randrange(len(new) + 1)
+                new[st:st + rnd.randint(0, 3)] = [rnd.choice(POOL).format(trial) for _ in range(rnd.randint(0, 3))]
+            new_c = "\n".join(new)
+            edits = me.line_edits(CONFIG, new_c)
+            self.assertEqual(me.apply_line_edits(CONFIG, edits), new_c, trial)
+            # правки приходят из JSON в любом порядке
+            self.assertEqual(me.apply_line_edits(CONFIG, list(reversed(edits))), new_c, trial)
+
+    def test_no_change_is_no_edits(self):
+        self.assertEqual(me.line_edits(CONFIG, CONFIG), [])
+        self.assertEqual(me.apply_line_edits(CONFIG, []), CONFIG)
+
+    def test_out_of_range(self):
+        n = len(CONFIG.split("\n"))
+        for e in ({"start": -1, "del": 0, "lines": []}, {"start": n, "del": 1, "lines": []},
+                  {"start": 0, "del": -1, "lines": []}):
+            with self.assertRaises(ValueError, msg=e):
+                me.apply_line_edits(CONFIG, [e])
+
+    def test_overlapping_edits_rejected(self):
+        with self.assertRaises(ValueError):
+            me.apply_line_edits(CONFIG, [{"start": 1, "del": 3, "lines": []}, {"start": 2, "del": 1, "lines": ["x"]}])